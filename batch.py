@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Command line batch runner, processes the layers listed on a JSON manifest
+ on a process pool without QGIS:
+
+     python -m Segreg.batch manifest.json --jobs 8
+
+ Manifest layout, job entries override the defaults:
+
+     {"defaults": {"id": "id", "x": "x", "y": "y", "groups": ["g1", "g2"],
+                   "bandwidths": [500, 1000], "kernels": [1],
+                   "measures": ["diss_global", "expo_local"],
+                   "output_dir": "results", "float_format": "%.6f"},
+      "jobs": [{"name": "city_a", "input": "city_a.csv"},
+               {"name": "city_b", "input": "city_b.gpkg", "layer": "tracts"}]}
+
+ Inputs are CSV files or GeoPackage tables with x, y and group columns.
+ Values are written with the shortest exact text unless float_format is set.
+ Local exposure columns can be limited with "options": {"exposure_pairs": "isolation"}
+ (or a reference group, or a list of [i, j] pairs) and "exposure_long": true also
+ writes every pair as id, i, j, value lines.
+"""
+from __future__ import absolute_import
+from builtins import range
+from builtins import str
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is reported as zero there
+    resource = None
+
+from .engine import ALL_MEASURES, LOCAL_MEASURES, SegregEngine
+from .export import write_local, write_long
+from .measures import exposure_pairs
+from .runlog import RunLog
+from .sweep import global_row, save_sweep
+
+# keys of a job entry after merging the manifest defaults
+JOB_DEFAULTS = dict(id=None, x='x', y='y', groups=None, layer=None, bandwidths=[], kernels=[1],
+                    measures=list(ALL_MEASURES), output_dir='.', float_format=None,
+                    exposure_long=False, options={})
+
+# columns of the batch report
+REPORT_COLUMNS = ['name', 'status', 'seconds', 'peak_mb', 'n_tracts', 'n_groups', 'error']
+
+
+def load_manifest(path):
+    """
+    Read a manifest and return the list of jobs with defaults applied.
+    Relative input and output paths are taken from the manifest directory.
+    :param path: path of the JSON manifest
+    :return: list of dicts, one per job
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+
+    jobs = []
+    for entry in manifest.get('jobs', []):
+        job = dict(JOB_DEFAULTS)
+        job.update(manifest.get('defaults', {}))
+        job.update(entry)
+        if 'input' not in job or not job['groups']:
+            raise ValueError('Each job needs an input and a list of groups!')
+        job.setdefault('name', os.path.splitext(os.path.basename(job['input']))[0])
+        job['input'] = os.path.join(base, job['input'])
+        job['output_dir'] = os.path.join(base, job['output_dir'])
+        jobs.append(job)
+    return jobs
+
+
+def _gpkg_table(connection, layer):
+    """Return the table to read, the first one of the GeoPackage if layer is None"""
+    if layer is not None:
+        return layer
+    row = connection.execute("SELECT table_name FROM gpkg_contents ORDER BY rowid LIMIT 1").fetchone()
+    if row is None:
+        raise ValueError('GeoPackage has no tables!')
+    return row[0]
+
+
+def load_table(path, x, y, groups, id_field=None, layer=None):
+    """
+    Read ids, coordinates and group populations from a CSV or GeoPackage.
+    :param path: input file, .gpkg is read as GeoPackage, anything else as CSV
+    :param x: name of the x coordinate column
+    :param y: name of the y coordinate column
+    :param groups: list of group column names
+    :param id_field: name of the id column, row number if None
+    :param layer: GeoPackage table, the first one if None
+    :return: tuple (ids, location, pop) with n string ids, n x 2 and n x m arrays
+    """
+    fields = [x, y] + list(groups)
+    columns = fields + ([id_field] if id_field is not None else [])
+
+    if path.lower().endswith('.gpkg'):
+        connection = sqlite3.connect(path)
+        try:
+            table = _gpkg_table(connection, layer)
+            query = 'SELECT %s FROM "%s"' % (', '.join('"%s"' % c for c in columns), table)
+            rows = connection.execute(query).fetchall()
+        finally:
+            connection.close()
+    else:
+        with open(path) as f:
+            reader = csv.DictReader(f)
+            rows = [[line[name] for name in columns] for line in reader]
+
+    # empty values are read as zero population
+    n = len(rows)
+    values = np.array([[np.nan if v in (None, '') else float(v) for v in row[:len(fields)]]
+                       for row in rows], dtype=float).reshape((n, len(fields)))
+    if id_field is not None:
+        ids = np.array([str(row[-1]) for row in rows])
+    else:
+        ids = np.array([str(i) for i in range(n)])
+    location = values[:, 0:2]
+    pop = np.nan_to_num(values[:, 2:])
+    return ids, location, pop
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory in MB of this process and of its finished child
+    processes, e.g. process backend workers. Unlike tracemalloc it includes
+    memmaps, BLAS buffers and other native allocations, at no run time cost.
+    :return: peak in MB, 0 where the resource module is missing
+    """
+    if resource is None:
+        return 0.0
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak / 1024.0 / 1024.0
+
+
+def run_job(job):
+    """
+    Compute one job and write its local and global outputs. Errors are
+    reported on the returned status instead of raised. The peak memory is
+    the one of the whole process, run_batch() starts a process per job.
+    :param job: dict from load_manifest()
+    :return: dict with the REPORT_COLUMNS
+    """
+    report = dict(name=job['name'], status='ok', seconds=0.0, peak_mb=0.0, n_tracts=0,
+                  n_groups=len(job['groups']), error='')
+    start = time.time()
+    log = RunLog(job=job['name'], input=job['input'], n_groups=len(job['groups']),
+                 engine=job['options'])
+    try:
+        with log.stage('load'):
+            ids, location, pop = load_table(job['input'], job['x'], job['y'], job['groups'],
+                                            job['id'], job['layer'])
+        report['n_tracts'] = len(ids)
+        log.update(n_tracts=len(ids))
+        if not os.path.isdir(job['output_dir']):
+            os.makedirs(job['output_dir'])
+
+        engine = SegregEngine(location, pop, **job['options'])
+        local_measures = [m for m in job['measures'] if m in LOCAL_MEASURES]
+        prefix = os.path.join(job['output_dir'], job['name'])
+        runs = [(k, bw) for k in job['kernels'] for bw in job['bandwidths']] or [(None, None)]
+
+        rows = []
+        try:
+            for kernel, bandwidth in runs:
+                with log.stage('run', bandwidth=bandwidth, kernel=kernel):
+                    result = engine.run(job['measures'], bandwidth, kernel)
+                rows.append(global_row(kernel, bandwidth, result.global_dissimilarity,
+                                       result.global_exposure, result.global_entropy,
+                                       result.global_indexh))
+                if bandwidth is None:
+                    path = '%s_local.csv' % prefix
+                else:
+                    path = '%s_k%s_bw%s_local.csv' % (prefix, kernel, bandwidth)
+                with log.stage('export', bandwidth=bandwidth, kernel=kernel):
+                    names, blocks = engine.resultColumns(local_measures)
+                    write_local(path, ids, names, blocks, job['float_format'])
+                    if job['exposure_long']:
+                        write_long(path.replace('_local.csv', '_exposure_long.csv'), ids,
+                                   exposure_pairs(engine.n_group), engine.exposureBlocks(),
+                                   job['float_format'])
+        finally:
+            engine.close()
+        save_sweep(rows, engine.n_group, '%s_global.csv' % prefix)
+        log.save('%s_runlog.json' % prefix)
+
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = '%s: %s' % (type(e).__name__, e)
+
+    report['seconds'] = time.time() - start
+    report['peak_mb'] = peak_memory_mb()
+    return report
+
+
+def run_batch(jobs, workers=1):
+    """
+    Run the jobs on a process pool, each job on a new process so its peak
+    memory is not mixed with the jobs run before on the same process.
+    :param jobs: list of dicts from load_manifest()
+    :param workers: number of processes
+    :return: list of reports in job order
+    """
+    if not jobs:
+        return []
+    workers = max(1, min(int(workers), len(jobs)))
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1)
+    except TypeError:
+        # Python before 3.11 reuses the processes, peaks are the highest so far
+        pool = ProcessPoolExecutor(max_workers=workers)
+    with pool:
+        return list(pool.map(run_job, jobs))
+
+
+def main(argv=None):
+    """Command line entry point, returns the process exit code"""
+    parser = argparse.ArgumentParser(prog='python -m Segreg.batch',
+                                     description='Compute segregation measures for many layers.')
+    parser.add_argument('manifest', help='JSON manifest with the jobs')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of parallel processes')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='output directory, overrides the manifest')
+    parser.add_argument('-r', '--report', default=None,
+                        help='csv file for the per-job report, batch_report.csv on the output directory')
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    if args.output_dir is not None:
+        for job in jobs:
+            job['output_dir'] = os.path.abspath(args.output_dir)
+
+    reports = run_batch(jobs, args.jobs)
+
+    # per-job summary on screen and on the report file
+    for r in reports:
+        print('%-30s %-7s %9.2fs %9.1f MB  %s' % (r['name'], r['status'], r['seconds'],
+                                                  r['peak_mb'], r['error']))
+    report_path = args.report
+    if report_path is None:
+        out = jobs[0]['output_dir'] if jobs else '.'
+        if not os.path.isdir(out):
+            os.makedirs(out)
+        report_path = os.path.join(out, 'batch_report.csv')
+    with open(report_path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        for r in reports:
+            writer.writerow(r)
+
+    return 0 if all(r['status'] == 'ok' for r in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
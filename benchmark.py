@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Benchmark suite on synthetic tract sets. Every stage (loading, intensity
+ by kernel, each local and global measure, the fused local measures and
+ export) is timed separately and saved as JSON to compare commits. Peak
+ traced memory is measured on an extra run, tracemalloc slows Python code
+ down several times and would hide the timings:
+
+     python -m Segreg.benchmark --sizes 1000 10000 --groups 2 20 -o bench.json
+     python -m Segreg.benchmark --compare before.json after.json
+"""
+from __future__ import absolute_import
+from builtins import range
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import scipy
+
+from .batch import load_table
+from .engine import LOCAL_MEASURES, SegregEngine
+from .export import write_local
+
+DEFAULT_SIZES = [1000, 10000, 50000, 200000]
+DEFAULT_GROUPS = [2, 20]
+
+# mean distance between synthetic tract centroids in meters
+TRACT_SPACING = 500.0
+
+# dense intensity is O(n^2), larger sets only run the KD-tree kernels
+DEFAULT_MAX_DENSE = 50000
+
+# intensity stages as (name, weightmethod, spatial_index)
+INTENSITY_STAGES = [('intensity_gauss', 1, False),
+                    ('intensity_bisquare', 2, False),
+                    ('intensity_window', 3, False),
+                    ('intensity_bisquare_kdtree', 2, True),
+                    ('intensity_window_kdtree', 3, True)]
+
+# measure stages in dependency order as (name, engine method)
+MEASURE_STAGES = [('local_dissimilarity', 'cal_localDissimilarity'),
+                  ('global_dissimilarity', 'cal_globalDissimilarity'),
+                  ('local_exposure', 'cal_localExposure'),
+                  ('global_exposure', 'cal_globalExposure'),
+                  ('local_entropy', 'cal_localEntropy'),
+                  ('global_entropy', 'cal_globalEntropy'),
+                  ('local_indexh', 'cal_localIndexH'),
+                  ('global_indexh', 'cal_globalIndexH'),
+                  ('local_measures_fused', 'cal_localMeasures')]
+
+
+def synthetic_tracts(n_tracts, n_groups, seed=0):
+    """
+    Generate a synthetic tract set with constant density and groups
+    segregated along a gradient, so intensities are not uniform.
+    :param n_tracts: number of tracts
+    :param n_groups: number of groups
+    :param seed: random seed
+    :return: tuple (location, pop) with n x 2 and n x m arrays
+    """
+    rng = np.random.RandomState(seed)
+    side = TRACT_SPACING * np.sqrt(n_tracts)
+    location = rng.uniform(0, side, (n_tracts, 2))
+
+    # each group peaks at a different position along the x axis
+    centers = np.linspace(0, side, n_groups)
+    share = np.exp(-((location[:, 0][:, None] - centers) / (side / max(1, n_groups))) ** 2)
+    share = share / share.sum(axis=1)[:, None]
+    pop = rng.poisson(1000 * share).astype(float)
+    return location, pop
+
+
+def _time(func):
+    """Run func untraced and return the seconds taken"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _peak(func):
+    """Run func under tracemalloc and return the peak MB allocated by it"""
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 1024.0 / 1024.0
+
+
+def run_case(n_tracts, n_groups, bandwidth, repeat=1, max_dense=DEFAULT_MAX_DENSE, seed=0,
+             dtype='float64', memory=True):
+    """
+    Time every stage for one tract set.
+    :param dtype: storage dtype of intensity and local measures
+    :param memory: run each stage once more under tracemalloc for its peak memory
+    :return: list of dicts with n, groups, stage, seconds, peak_mb and skipped
+    """
+    results = []
+    location, pop = synthetic_tracts(n_tracts, n_groups, seed)
+    scratch = tempfile.mkdtemp(prefix='segreg_bench_')
+
+    def record(stage, func, skip=False):
+        entry = dict(n=n_tracts, groups=n_groups, stage=stage, seconds=None, peak_mb=None,
+                     skipped=skip)
+        if not skip:
+            entry['seconds'] = min(_time(func) for _ in range(max(1, repeat)))
+            if memory:
+                entry['peak_mb'] = _peak(func)
+        results.append(entry)
+        sys.stderr.write('%8d tracts %3d groups  %-28s %s\n' % (
+            n_tracts, n_groups, stage, 'skipped' if skip else '%.4fs' % entry['seconds']))
+
+    try:
+        # loading from a csv file written once
+        source = os.path.join(scratch, 'tracts.csv')
+        groups = ['g%d' % i for i in range(n_groups)]
+        with open(source, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['id', 'x', 'y'] + groups)
+            for i in range(n_tracts):
+                writer.writerow([i] + list(location[i]) + list(pop[i]))
+        loaded = {}
+        record('load', lambda: loaded.update(table=load_table(source, 'x', 'y', groups, 'id')))
+        ids = loaded['table'][0]
+
+        engine = SegregEngine(location, pop, dtype=dtype)
+        for stage, weightmethod, spatial_index in INTENSITY_STAGES:
+            skip = not spatial_index and n_tracts > max_dense
+            record(stage, lambda: engine.cal_localityMatrix(bandwidth, weightmethod,
+                                                            spatial_index=spatial_index), skip)
+
+        # measures use the intensity of the last stage
+        for stage, method in MEASURE_STAGES:
+            record(stage, getattr(engine, method))
+
+        names, blocks = engine.resultColumns(LOCAL_MEASURES)
+        record('export', lambda: write_local(os.path.join(scratch, 'out.csv'), ids, names, blocks))
+        engine.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return results
+
+
+def environment():
+    """Describe the machine and commit the benchmark ran on"""
+    commit = None
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        commit = commit.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return dict(commit=commit, python=platform.python_version(), numpy=np.__version__,
+                scipy=scipy.__version__, platform=platform.platform(),
+                cpus=os.cpu_count(), time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def compare(before_path, after_path):
+    """Print the time and memory ratio of each stage between two result files"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    old = dict(((r['n'], r['groups'], r['stage']), r) for r in before['results'])
+
+    print('%8s %6s %-28s %10s %10s %8s %8s' % ('n', 'groups', 'stage', 'before', 'after',
+                                               'speedup', 'mem'))
+    for r in after['results']:
+        o = old.get((r['n'], r['groups'], r['stage']))
+        if o is None or r['skipped'] or o['skipped']:
+            continue
+        speedup = o['seconds'] / r['seconds'] if r['seconds'] else float('inf')
+        mem = r['peak_mb'] / o['peak_mb'] if r['peak_mb'] and o['peak_mb'] else float('nan')
+        print('%8d %6d %-28s %9.4fs %9.4fs %7.2fx %7.2fx' % (r['n'], r['groups'], r['stage'],
+                                                          o['seconds'], r['seconds'], speedup, mem))
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(prog='python -m Segreg.benchmark',
+                                     description='Benchmark the segregation measures.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='number of tracts of each synthetic set')
+    parser.add_argument('--groups', type=int, nargs='+', default=DEFAULT_GROUPS,
+                        help='number of groups of each synthetic set')
+    parser.add_argument('--bandwidth', type=float, default=1000.0, help='bandwidth in meters')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the fastest is kept')
+    parser.add_argument('--max-dense', type=int, default=DEFAULT_MAX_DENSE,
+                        help='largest set computed with the dense O(n^2) intensity')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                        help='storage dtype of intensity and local measures')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the traced runs measuring the peak memory')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON results file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two result files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    results = []
+    for n_tracts in args.sizes:
+        for n_groups in args.groups:
+            results.extend(run_case(n_tracts, n_groups, args.bandwidth, args.repeat,
+                                    args.max_dense, dtype=args.dtype, memory=args.memory))
+
+    with open(args.output, 'w') as f:
+        json.dump(dict(environment=environment(), bandwidth=args.bandwidth, dtype=args.dtype,
+                       results=results),
+                  f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
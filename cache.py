@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Result caches: a persistent one with intensity and measures saved as .npz
+ files keyed by a hash of the input arrays and parameters, and an in-memory
+ one for intensity columns and weights during a session. Both evict the
+ least recently used entries first when they grow over their size limit.
+"""
+from __future__ import absolute_import
+from builtins import object
+from builtins import str
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+# part of every key, bump when intensity or measures change their results
+CACHE_VERSION = 1
+
+# default size limit of the cache directory in bytes
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# default size limit of the in-memory column cache in bytes
+DEFAULT_COLUMN_CACHE_SIZE = 512 * 1024 * 1024
+
+
+def cache_key(*parts):
+    """
+    Hash arrays and parameters into a cache key.
+    :param parts: numpy arrays (hashed by dtype, shape and content) or values
+        hashed by their repr
+    :return: hex digest string
+    """
+    digest = hashlib.sha1(str(CACHE_VERSION).encode('utf-8'))
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(('%s%s' % (part.dtype.str, part.shape)).encode('utf-8'))
+            digest.update(part.tobytes())
+        else:
+            digest.update(repr(part).encode('utf-8'))
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Directory of .npz entries with a size limit and LRU eviction"""
+
+    def __init__(self, path, max_bytes=DEFAULT_CACHE_SIZE):
+        """
+        :param path: cache directory, created if missing
+        :param max_bytes: size limit of all entries together
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def entry_path(self, key):
+        """Path of the file of an entry"""
+        return os.path.join(self.path, '%s.npz' % key)
+
+    def get(self, key):
+        """
+        Load an entry and mark it as recently used.
+        :param key: key from cache_key()
+        :return: dict of {name: array}, None if missing or unreadable
+        """
+        path = self.entry_path(key)
+        try:
+            with np.load(path) as f:
+                entry = dict((name, f[name]) for name in f.files)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def put(self, key, **arrays):
+        """
+        Save an entry, written to a temporary file first so readers never see
+        it half written, then evict old entries over the size limit.
+        :param key: key from cache_key()
+        :param arrays: arrays (or scalars) to store by name
+        """
+        handle, temp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temp, self.entry_path(key))
+        except (IOError, OSError):
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+        self.evict()
+
+    def entries(self):
+        """List of (last use time, size, path) of the entries, oldest first"""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                path = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        """Size of all entries in bytes"""
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits its size limit"""
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all entries"""
+        for mtime, size, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ColumnCache(object):
+    """In-memory LRU of arrays and weight matrices bounded by their size in bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_COLUMN_CACHE_SIZE):
+        """
+        :param max_bytes: size limit of all items together
+        """
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key):
+        """Return an item and mark it as recently used, None if missing"""
+        item = self.items.pop(key, None)
+        if item is None:
+            return None
+        self.items[key] = item
+        return item[0]
+
+    def put(self, key, value):
+        """
+        Keep an item, evicting the least recently used ones over the size
+        limit. Items larger than the limit are not kept.
+        :param key: hashable key
+        :param value: numpy array or object with an nbytes attribute
+        """
+        self.discard(key)
+        nbytes = int(value.nbytes)
+        if nbytes > self.max_bytes:
+            return
+        self.items[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self.discard(next(iter(self.items)))
+
+    def discard(self, key):
+        """Remove an item if present"""
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[1]
+
+    def clear(self):
+        """Remove all items"""
+        self.items = OrderedDict()
+        self.nbytes = 0
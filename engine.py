@@ -0,0 +1,772 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Headless segregation engine. Only NumPy and SciPy are used, so it can be
+ imported and run without QGIS:
+
+     from Segreg.engine import SegregEngine
+     engine = SegregEngine(location, pop)
+     result = engine.run(bandwidth=1000, weightmethod=1)
+"""
+from __future__ import absolute_import
+from builtins import object
+from builtins import range
+from builtins import str
+from collections import namedtuple
+import os.path
+import numpy as np
+
+from .cache import DEFAULT_CACHE_SIZE, ResultCache, cache_key
+from .intensity import (DEFAULT_BLOCK_SIZE, locality_matrix, locality_update, support_radius,
+                        truncation_error)
+from .outofcore import DEFAULT_MEMORY_BUDGET, ScratchSpace, rows_for_budget
+from .sweep import bandwidth_sweep
+from .weights import WeightMatrix, geometry_fingerprint
+from . import measures
+
+# measure names, the same used by the plugin dialog check boxes
+LOCAL_MEASURES = ('diss_local', 'expo_local', 'entro_local', 'idxh_local')
+GLOBAL_MEASURES = ('diss_global', 'expo_global', 'entro_global', 'idxh_global')
+ALL_MEASURES = LOCAL_MEASURES + GLOBAL_MEASURES
+
+# measure DAG, inputs of each measure. 'pop' and 'locality' are the data,
+# results are memoized with the versions of the data they were computed on
+MEASURE_INPUTS = {'diss_local': ('pop', 'locality'),
+                  'diss_global': ('diss_local',),
+                  'expo_local': ('pop', 'locality'),
+                  'expo_global': ('pop', 'locality'),
+                  'entro_local': ('pop', 'locality'),
+                  'entro_global': ('pop',),
+                  'idxh_local': ('pop', 'entro_local', 'entro_global'),
+                  'idxh_global': ('idxh_local',)}
+
+# engine attribute holding each measure
+MEASURE_ATTRIBUTES = {'diss_local': 'local_dissimilarity',
+                      'diss_global': 'global_dissimilarity',
+                      'expo_local': 'local_exposure',
+                      'expo_global': 'global_exposure',
+                      'entro_local': 'local_entropy',
+                      'entro_global': 'global_entropy',
+                      'idxh_local': 'local_indexh',
+                      'idxh_global': 'global_indexh'}
+
+# fused kernel name of each local measure
+FUSED_NAMES = {'diss_local': 'dissimilarity',
+               'expo_local': 'exposure',
+               'entro_local': 'entropy',
+               'idxh_local': 'indexh'}
+
+# measures left out of the result cache, the n x m*m local exposure is cheaper to
+# compute again from the cached intensity than to write on every export
+UNCACHED_MEASURES = ('expo_local',)
+
+# truncated gaussian error fields, saved as one array with the cached intensity
+TRUNCATION_FIELDS = ('max_abs_error', 'max_rel_error', 'cutoff', 'rows_checked')
+
+# results of a run, measures not computed are None
+SegregResult = namedtuple('SegregResult', [
+    'bandwidth', 'weightmethod', 'locality',
+    'local_dissimilarity', 'local_exposure', 'local_entropy', 'local_indexh',
+    'global_dissimilarity', 'global_exposure', 'global_entropy', 'global_indexh'])
+
+
+class SegregEngine(object):
+    """
+    Population intensity and segregation measures for one set of tracts.
+    Attributes and cal_* methods mirror the ones of the QGIS plugin class,
+    which calls this engine internally.
+    """
+
+    def __init__(self, location, pop, block_size=DEFAULT_BLOCK_SIZE, spatial_index=False,
+                 workers=1, backend='thread', reuse_weights=False, weight_sidecar=None,
+                 weight_matrix=None, out_of_core=False, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 scratch_dir=None, gauss_tolerance=None, dtype=float, exposure_pairs=None,
+                 cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, column_cache=None):
+        """
+        :param location: 2d array like (n x 2) with x and y coordinates of each tract
+        :param pop: 2d array like (n x m) with population of each group by tract,
+            negative values are set to zero
+        :param block_size: tracts computed at once by the intensity engine
+        :param spatial_index: use KD-tree neighbors for compact kernels
+        :param workers: parallel workers for the intensity engine
+        :param backend: parallel backend, 'thread' or 'process'
+        :param reuse_weights: keep weights between runs in a WeightMatrix
+        :param weight_sidecar: source file path to save/load the weights .npz sidecar
+        :param weight_matrix: WeightMatrix from a previous run to be reused if it matches
+        :param out_of_core: keep large arrays on memmap files in a scratch directory
+        :param memory_budget: bytes per row block in out-of-core mode
+        :param scratch_dir: parent of scratch files, system temp directory if None
+        :param gauss_tolerance: drop gaussian weights below this relative tolerance,
+            None for the exact kernel
+        :param dtype: storage dtype of intensity and local measures, np.float32 halves
+            their memory, blocks and global sums are still computed in double precision
+        :param exposure_pairs: group pairs of the local exposure, all when None, 'isolation',
+            a reference group against the others or a list of (i, j), see measures.exposure_pairs()
+        :param cache_dir: directory of the persistent result cache, disabled if None
+        :param cache_size: size limit of the result cache in bytes
+        :param column_cache: cache.ColumnCache shared by the engines of a session, keeping
+            intensity columns by group and weight matrices, disabled if None
+        """
+        self.location = np.array(location, dtype=float).reshape((-1, 2))
+        self.pop = np.array(pop, dtype=float)
+        if self.pop.ndim == 1:
+            self.pop = self.pop.reshape((-1, 1))
+        self.pop[self.pop < 0] = 0.0
+        if self.pop.shape[0] != self.location.shape[0]:
+            raise ValueError('location and pop must have the same number of tracts!')
+        self.pop_sum = np.sum(self.pop, axis=1).reshape((-1, 1))
+        self.n_location, self.n_group = self.pop.shape
+
+        # options
+        self.block_size = block_size
+        self.spatial_index = spatial_index
+        self.workers = workers
+        self.backend = backend
+        self.reuse_weights = reuse_weights
+        self.weightSidecar = weight_sidecar
+        self.weightMatrix = weight_matrix
+        self.out_of_core = out_of_core
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self.scratch = None
+        self.gauss_tolerance = gauss_tolerance
+        self.dtype = np.dtype(dtype)
+        self.exposurePairs = measures.exposure_pairs(self.n_group, exposure_pairs)
+        self.cache = None if cache_dir is None else ResultCache(cache_dir, cache_size)
+        self.dataHash = None
+        self.column_cache = column_cache
+        self.geometryHash = None
+
+        # parameters of the last intensity run
+        self.bandwidth = None
+        self.weightmethod = None
+
+        # data versions and the key each measure was computed with
+        self.versions = {'pop': 0, 'locality': 0}
+        self.memo = {}
+
+        self.clearResults()
+
+    def clearResults(self):
+        """Clear intensity and measures"""
+        self.locality = None
+        self.weightSum = None
+        self.versions['locality'] += 1
+        self.truncationError = None
+        self.clearLocalResults()
+        self.global_dissimilarity = None
+        self.global_exposure = None
+        self.global_entropy = None
+        self.global_indexh = None
+        self.memo = {}
+
+    def clearLocalResults(self):
+        """Clear local measures only"""
+        self.local_dissimilarity = None
+        self.local_exposure = None
+        self.local_entropy = None
+        self.local_indexh = None
+        for name in LOCAL_MEASURES:
+            self.memo.pop(name, None)
+
+    def measureKey(self, name):
+        """Versions of the data a measure depends on, through the measure DAG"""
+        if name in self.versions:
+            return ((name, self.versions[name]),)
+        return tuple(sorted(set(key for node in MEASURE_INPUTS[name]
+                                for key in self.measureKey(node))))
+
+    def isFresh(self, name):
+        """Check if a measure was computed with the current data"""
+        return self.memo.get(name) == self.measureKey(name)
+
+    def schedule(self, selected):
+        """
+        Measures to compute for the selection, the selected ones and their
+        inputs that are missing or stale, in dependency order.
+        :param selected: measure names from ALL_MEASURES
+        :return: list of measure names
+        """
+        order = []
+
+        def visit(name):
+            if name in self.versions or name in order or self.isFresh(name):
+                return
+            for node in MEASURE_INPUTS[name]:
+                visit(node)
+            order.append(name)
+
+        for name in ALL_MEASURES:
+            if name in selected:
+                visit(name)
+        return order
+
+    def compute(self, selected, progress=None):
+        """
+        Compute the selected measures running only the missing or stale
+        ones, local measures are computed together in a single pass.
+        :param selected: measure names from ALL_MEASURES
+        :param progress: optional callable receiving the done fraction of the local
+            measures pass, it may raise intensity.Cancelled to stop the run
+        :return: list of measure names computed
+        """
+        unknown = [name for name in selected if name not in ALL_MEASURES]
+        if unknown:
+            raise ValueError('Invalid measures selected: %s' % ', '.join(unknown))
+
+        # measures saved on the result cache are loaded first, selected ones
+        # before their inputs, which are then only loaded if still needed
+        if self.cache is not None:
+            for name in ALL_MEASURES:
+                if name in selected:
+                    self.loadCached(name)
+            for name in self.schedule(selected):
+                self.loadCached(name)
+
+        order = self.schedule(selected)
+        self.cal_localMeasures([name for name in order if name in LOCAL_MEASURES], progress)
+        calls = {'diss_global': self.cal_globalDissimilarity,
+                 'expo_global': self.cal_globalExposure,
+                 'entro_global': self.cal_globalEntropy,
+                 'idxh_global': self.cal_globalIndexH}
+        for name in order:
+            if name in calls and not self.isFresh(name):
+                calls[name]()
+        for name in order:
+            self.storeCached(name)
+        return order
+
+    def memoize(self, name):
+        """Record that a measure was computed with the current data"""
+        self.memo[name] = self.measureKey(name)
+
+    def dataKey(self):
+        """Content hash of coordinates and population, kept until the population changes"""
+        if self.dataHash is None or self.dataHash[0] != self.versions['pop']:
+            self.dataHash = (self.versions['pop'], cache_key(self.location, self.pop))
+        return self.dataHash[1]
+
+    def localityKey(self, bandwidth, weightmethod):
+        """Result cache key of the intensity for a bandwidth and weight method"""
+        tolerance = self.gauss_tolerance if weightmethod == 1 else None
+        return cache_key('locality', self.dataKey(), bandwidth, weightmethod, tolerance,
+                         self.dtype.name)
+
+    def geometryKey(self):
+        """Fingerprint of the tract coordinates, which never change"""
+        if self.geometryHash is None:
+            self.geometryHash = geometry_fingerprint(self.location)
+        return self.geometryHash
+
+    def columnKeys(self, bandwidth, weightmethod):
+        """
+        Column cache keys of an intensity run. Each group column depends only
+        on the geometry, the kernel and that group population.
+        :return: tuple (weight sum key, list of keys of each group column)
+        """
+        tolerance = self.gauss_tolerance if weightmethod == 1 else None
+        base = (self.geometryKey(), bandwidth, weightmethod, tolerance, self.dtype.name)
+        return (base + ('weight_sum',),
+                [base + (cache_key(self.pop[:, g]),) for g in range(self.n_group)])
+
+    def cacheKey(self, name):
+        """Result cache key of a measure on the current data and intensity"""
+        if self.locality is None:
+            base = cache_key('nonspatial', self.dataKey())
+        else:
+            base = self.localityKey(self.bandwidth, self.weightmethod)
+        pairs = self.exposurePairs if name == 'expo_local' else None
+        return cache_key(base, name, pairs, self.dtype.name)
+
+    def loadCached(self, name):
+        """
+        Take a measure from the result cache if it was saved for the current
+        data, intensity and options.
+        :param name: measure name from ALL_MEASURES
+        :return: True if found
+        """
+        if self.cache is None or name in UNCACHED_MEASURES or self.isFresh(name):
+            return False
+        entry = self.cache.get(self.cacheKey(name))
+        if entry is None:
+            return False
+        value = entry['value']
+        setattr(self, MEASURE_ATTRIBUTES[name], value[()] if value.ndim == 0 else value)
+        self.memoize(name)
+        return True
+
+    def storeCached(self, name):
+        """Save a measure computed on the current data to the result cache"""
+        if self.cache is not None and name not in UNCACHED_MEASURES and self.isFresh(name):
+            self.cache.put(self.cacheKey(name), value=getattr(self, MEASURE_ATTRIBUTES[name]))
+
+    def close(self):
+        """Release results and remove out-of-core scratch files"""
+        self.clearResults()
+        if self.scratch is not None:
+            self.scratch.cleanup()
+            self.scratch = None
+
+    def scratchArray(self, name, shape, dtype=None):
+        """Create a memory-mapped array in the scratch directory of this engine"""
+        if self.scratch is None:
+            self.scratch = ScratchSpace(self.scratch_dir)
+        return self.scratch.array(name, shape, self.dtype if dtype is None else dtype)
+
+    def budgetRows(self, row_items, workers=1):
+        """Rows per block within the memory budget, None if not out-of-core"""
+        if self.out_of_core is not True:
+            return None
+        return rows_for_budget(self.memory_budget, row_items, workers=workers)
+
+    def cal_localityMatrix(self, bandwidth, weightmethod, block_size=None, spatial_index=None,
+                           workers=None, backend=None, progress=None):
+        """
+        Compute the local population intensity for all groups. Results are
+        stored only when the run completes.
+        :param bandwidth: bandwidth for neighborhood in meters
+        :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+        :param block_size: tracts computed at once, defaults to self.block_size
+        :param spatial_index: use KD-tree neighbors for bi-square and moving window,
+            defaults to self.spatial_index
+        :param workers: parallel workers over row chunks, defaults to self.workers
+        :param backend: 'thread' or 'process', defaults to self.backend
+        :param progress: optional callable receiving the done fraction, it may raise
+            intensity.Cancelled to stop the run
+        :return: 2d array with population intensity for all groups
+        """
+        if block_size is None:
+            block_size = self.block_size
+        if spatial_index is None:
+            spatial_index = self.spatial_index
+        if workers is None:
+            workers = self.workers
+        if backend is None:
+            backend = self.backend
+
+        # out-of-core mode writes to a new memmap with blocks sized by the memory
+        # budget, the current intensity is kept until the run completes
+        out = None
+        if self.out_of_core is True:
+            block_size = min(block_size, self.budgetRows(self.n_location + self.n_group, workers))
+            out = self.scratchArray('locality', (self.n_location, self.n_group))
+
+        # intensity saved on the result cache for the same data and parameters
+        key = None if self.cache is None else self.localityKey(bandwidth, weightmethod)
+        entry = None if key is None else self.cache.get(key)
+        # groups with an intensity column kept from earlier runs of this session
+        columns = {}
+        if entry is None and self.column_cache is not None:
+            sum_key, column_keys = self.columnKeys(bandwidth, weightmethod)
+            if self.column_cache.get(sum_key) is not None:
+                for g, column_key in enumerate(column_keys):
+                    column = self.column_cache.get(column_key)
+                    if column is not None:
+                        columns[g] = column
+        missing = [g for g in range(self.n_group) if g not in columns]
+        pop = self.pop if not columns else self.pop[:, missing]
+        target = out if not columns else None
+        if columns and missing and out is not None:
+            # missing groups go to their own scratch file, joined into out by row blocks
+            target = self.scratchArray('locality_missing', (self.n_location, len(missing)))
+
+        if entry is not None:
+            locality = entry['locality']
+            weight_sum = entry['weight_sum']
+            if out is not None:
+                out[...] = locality
+                locality = out
+            if progress is not None:
+                progress(1.0)
+        elif not missing:
+            locality = None
+            weight_sum = self.column_cache.get(sum_key)
+            if progress is not None:
+                progress(1.0)
+        elif self.reuse_weights is True:
+            # reuse weights computed for the same geometry, bandwidth and kernel
+            weights = self.getWeightMatrix(bandwidth, weightmethod, block_size)
+            if target is None:
+                locality = weights.apply(pop).astype(self.dtype, copy=False)
+            else:
+                locality = weights.apply(pop, target, block_size)
+            weight_sum = weights.row_sum
+            if progress is not None:
+                progress(1.0)
+        else:
+            weight_sum = np.empty(self.n_location)
+            locality = locality_matrix(self.location, pop, bandwidth, weightmethod,
+                                       block_size, spatial_index, workers, backend, target,
+                                       self.gauss_tolerance, self.dtype, weight_sum, progress)
+
+        # join the cached columns and keep the new ones for later runs
+        if columns:
+            computed = locality
+            locality = out if out is not None else np.empty((self.n_location, self.n_group),
+                                                            dtype=self.dtype)
+            for g, column in columns.items():
+                locality[:, g] = column
+            if missing:
+                step = self.n_location if out is None else block_size
+                for start in range(0, self.n_location, step):
+                    stop = min(start + step, self.n_location)
+                    locality[start:stop, missing] = computed[start:stop]
+            if missing and out is not None:
+                del computed
+                self.scratch.release('locality_missing')
+        if entry is None and self.column_cache is not None:
+            self.column_cache.put(sum_key, weight_sum)
+            for g in missing:
+                self.column_cache.put(column_keys[g], np.array(locality[:, g]))
+
+        # approximation error of the truncated gaussian, kept with the cached
+        # intensity so runs taken from the caches skip the exact kernel
+        error = None
+        if weightmethod == 1 and self.gauss_tolerance is not None:
+            error_key = ('truncation_error', self.localityKey(bandwidth, weightmethod))
+            if entry is not None:
+                error = entry.get('truncation_error')
+            if error is None and self.column_cache is not None:
+                error = self.column_cache.get(error_key)
+            if error is None:
+                error = truncation_error(self.location, self.pop, bandwidth, self.gauss_tolerance,
+                                         locality, block_size=block_size)
+                error = np.array([error[name] for name in TRUNCATION_FIELDS], dtype=float)
+            if self.column_cache is not None:
+                self.column_cache.put(error_key, error)
+
+        # save a new intensity for later runs on the same input
+        if key is not None and entry is None:
+            stored = dict(locality=locality, weight_sum=weight_sum)
+            if error is not None:
+                stored['truncation_error'] = error
+            self.cache.put(key, **stored)
+
+        self.locality = locality
+        self.weightSum = weight_sum
+        self.bandwidth = bandwidth
+        self.weightmethod = weightmethod
+        self.versions['locality'] += 1
+        self.truncationError = None
+        if error is not None:
+            self.truncationError = dict(zip(TRUNCATION_FIELDS, error.tolist()))
+            self.truncationError['rows_checked'] = int(error[-1])
+        return self.locality
+
+    def updatePopulation(self, rows, values):
+        """
+        Change the population of a few tracts and patch the intensity and the
+        measures computed so far, instead of recomputing them from scratch.
+        Intensity is updated in O(n.k) with the weight columns of the k tracts.
+        The result cache is not used, hashing the data and writing .npz files on
+        every edit would cost more than the update.
+        :param rows: indices of the changed tracts
+        :param values: k x m array with their new population by group,
+            negative values are set to zero
+        :return: list of measure names recomputed
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        values = np.array(values, dtype=float).reshape((len(rows), self.n_group))
+        values[values < 0] = 0.0
+        computed = [name for name in ALL_MEASURES if self.isFresh(name)]
+
+        delta = values - self.pop[rows]
+        self.pop[rows] = values
+        self.pop_sum = np.sum(self.pop, axis=1).reshape((-1, 1))
+        self.versions['pop'] += 1
+
+        if self.locality is not None:
+            locality_update(self.location, self.locality, self.weightSum, rows, delta,
+                            self.bandwidth, self.weightmethod, self.gauss_tolerance)
+            self.versions['locality'] += 1
+
+        cache, self.cache = self.cache, None
+        try:
+            return self.compute(computed)
+        finally:
+            self.cache = cache
+
+    def getWeightMatrix(self, bandwidth, weightmethod, block_size=None):
+        """
+        Return the weight matrix for this geometry. The one in memory or the
+        .npz sidecar are reused if built for the same geometry, bandwidth and
+        weight method, otherwise a new one is computed and saved.
+        :param bandwidth: bandwidth for neighborhood in meters
+        :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+        :param block_size: tracts computed at once, defaults to self.block_size
+        :return: WeightMatrix instance
+        """
+        if block_size is None:
+            block_size = self.block_size
+        weights = self.weightMatrix
+        tolerance = self.gauss_tolerance
+        if weights is not None and weights.matches(self.location, bandwidth, weightmethod, tolerance):
+            return weights
+
+        # weights kept earlier in this session for the same geometry
+        key = None
+        if self.column_cache is not None:
+            key = (self.geometryKey(), 'weights', bandwidth, weightmethod,
+                   tolerance if weightmethod == 1 else None)
+            weights = self.column_cache.get(key)
+            if weights is not None:
+                self.weightMatrix = weights
+                return weights
+
+        # try the sidecar saved on a previous run
+        path = None
+        if self.weightSidecar is not None:
+            path = WeightMatrix.sidecar_path(self.weightSidecar, bandwidth, weightmethod, tolerance)
+            if os.path.exists(path):
+                try:
+                    weights = WeightMatrix.load(path)
+                except (IOError, ValueError, KeyError):
+                    weights = None
+                if weights is not None and weights.matches(self.location, bandwidth, weightmethod,
+                                                           tolerance):
+                    self.weightMatrix = weights
+                    if key is not None:
+                        self.column_cache.put(key, weights)
+                    return weights
+
+        # dense weights are cached on disk in out-of-core mode
+        out = None
+        if self.out_of_core is True and support_radius(bandwidth, weightmethod, tolerance) is None:
+            self.weightMatrix = None
+            out = self.scratchArray('weights', (self.n_location, self.n_location), float)
+        weights = WeightMatrix.build(self.location, bandwidth, weightmethod, block_size, out,
+                                     tolerance)
+        if path is not None:
+            try:
+                weights.save(path)
+            except (IOError, OSError):
+                pass
+        self.weightMatrix = weights
+
+        # memmap weights belong to the scratch space of this engine and are not kept
+        if key is not None and out is None:
+            self.column_cache.put(key, weights)
+        return weights
+
+    def cal_localDissimilarity(self):
+        """Compute local dissimilarity for all groups"""
+        block_size = self.budgetRows(4 * self.n_group)
+        self.local_dissimilarity = measures.local_dissimilarity(self.pop, self.locality, block_size,
+                                                                dtype=self.dtype)
+        self.memoize('diss_local')
+        return self.local_dissimilarity
+
+    def cal_globalDissimilarity(self):
+        """Compute global dissimilarity summing up the local version"""
+        if not self.isFresh('diss_local'):
+            self.cal_localDissimilarity()
+        self.global_dissimilarity = measures.global_dissimilarity(self.local_dissimilarity)
+        self.memoize('diss_global')
+        return self.global_dissimilarity
+
+    def cal_localExposure(self):
+        """
+        Compute the local exposure index of group m to group n.
+        in situations where m=n, then the result is the isolation index.
+        Only the group pairs of self.exposurePairs are computed.
+        """
+        m, p = self.n_group, len(self.exposurePairs)
+        block_size = self.budgetRows(2 * p + 4 * m)
+        out = None
+        if block_size is not None:
+            out = self.scratchArray('local_exposure', (self.n_location, p))
+        self.local_exposure = measures.local_exposure(self.pop, self.locality, block_size, out,
+                                                      self.dtype, self.exposurePairs)
+        self.memoize('expo_local')
+        return self.local_exposure
+
+    def setExposurePairs(self, pairs=None):
+        """Change the group pairs of the local exposure, see measures.exposure_pairs()"""
+        pairs = measures.exposure_pairs(self.n_group, pairs)
+        if pairs != self.exposurePairs:
+            self.exposurePairs = pairs
+            self.local_exposure = None
+            self.memo.pop('expo_local', None)
+
+    def exposureBlocks(self, pairs=None, block_size=None):
+        """
+        Local exposure of the given group pairs by row blocks on the current
+        intensity, without keeping all rows, see measures.exposure_blocks().
+        :param pairs: group pairs, all when None
+        :param block_size: rows computed at once, defaults to self.block_size
+        :return: generator of (start, stop, block)
+        """
+        if block_size is None:
+            block_size = self.block_size
+        return measures.exposure_blocks(self.pop, self.locality, pairs, block_size)
+
+    def cal_globalExposure(self):
+        """
+        Compute global exposure straight from intensity and population, the
+        n x m*m local version is not needed.
+        """
+        block_size = self.budgetRows(4 * self.n_group)
+        self.global_exposure = measures.global_exposure_direct(self.pop, self.locality, block_size)
+        self.memoize('expo_global')
+        return self.global_exposure
+
+    def cal_localEntropy(self):
+        """
+        Compute local entropy score for a unit area Ei (diversity), spatial if
+        population intensity was computed, otherwise non spatial (raw data).
+        """
+        block_size = self.budgetRows(4 * self.n_group)
+        self.local_entropy = measures.local_entropy(self.pop, self.locality, block_size,
+                                                    dtype=self.dtype)
+        self.memoize('entro_local')
+        return self.local_entropy
+
+    def cal_globalEntropy(self):
+        """Compute the global entropy score E (diversity), metropolitan area's entropy score"""
+        self.global_entropy = measures.global_entropy(self.pop)
+        self.memoize('entro_global')
+        return self.global_entropy
+
+    def cal_localIndexH(self):
+        """Compute the local entropy index H for all localities"""
+        if not self.isFresh('entro_local'):
+            self.cal_localEntropy()
+        if not self.isFresh('entro_global'):
+            self.cal_globalEntropy()
+        self.local_indexh = measures.local_indexh(self.pop, self.local_entropy, self.global_entropy)
+        self.memoize('idxh_local')
+        return self.local_indexh
+
+    def cal_globalIndexH(self):
+        """Compute global index H summing up the local version"""
+        if not self.isFresh('idxh_local'):
+            self.cal_localIndexH()
+        self.global_indexh = measures.global_indexh(self.local_indexh)
+        self.memoize('idxh_global')
+        return self.global_indexh
+
+    def cal_localMeasures(self, selected=LOCAL_MEASURES, progress=None):
+        """
+        Compute several local measures in a single pass over intensity and
+        population, see measures.fused_local_measures().
+        :param selected: local measure names from LOCAL_MEASURES
+        :param progress: optional callable receiving the done fraction, it may raise
+            intensity.Cancelled to stop the run
+        :return: dict of {name: array}
+        """
+        selected = [name for name in LOCAL_MEASURES if name in selected]
+        if not selected:
+            return {}
+        m, p = self.n_group, len(self.exposurePairs)
+        block_size = self.budgetRows(2 * p + 6 * m)
+        out = {}
+        if block_size is not None and 'expo_local' in selected:
+            out['exposure'] = self.scratchArray('local_exposure', (self.n_location, p))
+
+        results = measures.fused_local_measures(self.pop, self.locality,
+                                                [FUSED_NAMES[name] for name in selected],
+                                                block_size, out, self.dtype, progress,
+                                                self.exposurePairs)
+        for name in selected:
+            setattr(self, MEASURE_ATTRIBUTES[name], results[FUSED_NAMES[name]])
+            self.memoize(name)
+        if 'idxh_local' in selected and not self.isFresh('entro_global'):
+            self.cal_globalEntropy()
+        return dict((name, getattr(self, MEASURE_ATTRIBUTES[name])) for name in selected)
+
+    def run(self, selected=ALL_MEASURES, bandwidth=None, weightmethod=1):
+        """
+        Compute the requested measures, spatial if a bandwidth is given,
+        otherwise non spatial (raw data).
+        :param selected: measure names from ALL_MEASURES
+        :param bandwidth: bandwidth for neighborhood in meters, None for non spatial
+        :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+        :return: SegregResult
+        """
+        unknown = [name for name in selected if name not in ALL_MEASURES]
+        if unknown:
+            raise ValueError('Invalid measures selected: %s' % ', '.join(unknown))
+
+        self.clearResults()
+        if bandwidth is not None:
+            self.cal_localityMatrix(bandwidth, weightmethod)
+        else:
+            self.bandwidth = None
+            self.weightmethod = None
+
+        self.compute(selected)
+        return self.results()
+
+    def results(self):
+        """Return the current intensity and measures as a SegregResult"""
+        return SegregResult(self.bandwidth, self.weightmethod, self.locality,
+                            self.local_dissimilarity, self.local_exposure,
+                            self.local_entropy, self.local_indexh,
+                            self.global_dissimilarity, self.global_exposure,
+                            self.global_entropy, self.global_indexh)
+
+    def sweep(self, bandwidths, weightmethods=(1,), keep_locality=False, progress=None):
+        """
+        Compute global measures for a list of bandwidths and weight methods
+        sharing the distance computation, see sweep.bandwidth_sweep().
+        """
+        return bandwidth_sweep(self.location, self.pop, bandwidths, weightmethods,
+                               self.block_size, self.spatial_index, keep_locality,
+                               self.gauss_tolerance, progress)
+
+    def resultColumns(self, local_measures=LOCAL_MEASURES):
+        """
+        Names and numeric blocks of the local results, in output order:
+        coordinates, groups, intensity (if computed) and the local measures
+        computed on the current intensity.
+        :param local_measures: local measure names to include
+        :return: tuple (names, blocks), blocks is a list of 2d arrays
+        """
+        names = ['x', 'y']
+        blocks = [self.location, self.pop]
+
+        # create new names for groups starting by 0
+        for i in range(self.n_group):
+            names.append('group_' + str(i))
+
+        # update names with locality if computed
+        if self.locality is not None:
+            blocks.append(self.locality)
+            for i in range(self.n_group):
+                names.append('intens_' + str(i))
+
+        # update names with exposure/isolation if computed
+        if 'expo_local' in local_measures and self.isFresh('expo_local'):
+            blocks.append(self.local_exposure)
+            for i, j in self.exposurePairs:
+                if i == j:
+                    names.append('iso_' + str(i) + str(j))
+                else:
+                    names.append('exp_' + str(i) + str(j))
+
+        # update names with dissimilarity, entropy and index H if computed
+        for name, label, values in (('diss_local', 'dissimil', self.local_dissimilarity),
+                                    ('entro_local', 'entropy', self.local_entropy),
+                                    ('idxh_local', 'indexh', self.local_indexh)):
+            if name in local_measures and self.isFresh(name):
+                blocks.append(np.asarray(values).reshape((-1, 1)))
+                names.append(label)
+
+        return names, blocks
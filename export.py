@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Typed export of local results: ids and numeric blocks are formatted and
+ written in row chunks, so no full string copy of the results is built.
+"""
+from __future__ import absolute_import
+from builtins import range
+import csv
+import numpy as np
+
+# rows formatted and written at once
+EXPORT_ROWS = 4096
+
+
+def format_block(values, float_format=None):
+    """
+    Format a 2d block as text.
+    :param values: 2d array like
+    :param float_format: printf style format of float values, e.g. '%.6f', or None
+        for the shortest text that round-trips the block's own dtype
+    :return: 2d array of strings
+    """
+    values = np.asarray(values)
+    if float_format is not None and values.dtype.kind == 'f':
+        return np.char.mod(float_format, values)
+    return values.astype(str)
+
+
+def write_local(path, ids, names, blocks, float_format=None, header=None, chunk_rows=EXPORT_ROWS,
+                progress=None):
+    """
+    Write the local results to a csv file, ids first and one line per tract.
+    Blocks keep their dtype and only chunk_rows rows are turned into text at
+    a time, so the peak memory stays near the size of one chunk.
+    :param path: output csv path
+    :param ids: n ids
+    :param names: column names of the blocks
+    :param blocks: list of 2d arrays with n rows
+    :param float_format: printf style format of float values, None for the shortest
+        text that round-trips their dtype, so float32 is not widened to 17 digits
+    :param header: first line of the file, the comma separated 'id' and names if None
+    :param chunk_rows: rows formatted and written at once
+    :param progress: optional callable receiving the done fraction after each chunk
+    """
+    ids = np.asarray(ids).reshape(-1)
+    n = ids.shape[0]
+    chunk_rows = max(1, int(chunk_rows))
+    with open(path, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        if header is None:
+            writer.writerow(['id'] + list(names))
+        else:
+            f.write(header + '\n')
+        for start in range(0, n, chunk_rows):
+            stop = min(start + chunk_rows, n)
+            cells = [ids[start:stop].astype(str).reshape((-1, 1))]
+            cells.extend(format_block(b[start:stop], float_format) for b in blocks)
+            writer.writerows(np.concatenate(cells, axis=1).tolist())
+            if progress is not None:
+                progress(stop * 1.0 / n)
+
+
+def write_long(path, ids, pairs, blocks, float_format=None, progress=None):
+    """
+    Write local values by group pair in long format, one line per tract and
+    pair: id, i, j, value. Blocks are written as they come, so the full
+    n x len(pairs) matrix is never kept.
+    :param path: output csv path
+    :param ids: n ids
+    :param pairs: list of (i, j) group pairs, one per block column
+    :param blocks: iterable of (start, stop, block) as measures.exposure_blocks()
+    :param float_format: printf style format of values, None for the shortest exact text
+    :param progress: optional callable receiving the done fraction after each block
+    """
+    ids = np.asarray(ids).reshape(-1)
+    n = ids.shape[0]
+    first = np.array([str(p[0]) for p in pairs])
+    second = np.array([str(p[1]) for p in pairs])
+    with open(path, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['id', 'i', 'j', 'value'])
+        for start, stop, block in blocks:
+            rows = stop - start
+            cells = np.empty((rows * len(pairs), 4), dtype=object)
+            cells[:, 0] = np.repeat(ids[start:stop].astype(str), len(pairs))
+            cells[:, 1] = np.tile(first, rows)
+            cells[:, 2] = np.tile(second, rows)
+            cells[:, 3] = format_block(block, float_format).reshape(-1)
+            writer.writerows(cells.tolist())
+            if progress is not None:
+                progress(stop * 1.0 / n)
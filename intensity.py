@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Population intensity engine. Kept free of Qt imports so it can be used
+ outside QGIS.
+"""
+from __future__ import absolute_import
+from builtins import range
+from builtins import object
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
+import os.path
+import threading
+import weakref
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+# number of tracts (rows) processed at once by the blocked engine
+DEFAULT_BLOCK_SIZE = 256
+
+# kernels with compact support, weights are zero beyond the bandwidth
+COMPACT_KERNELS = (2, 3)
+
+# rows checked against the exact gaussian to report the truncation error
+DEFAULT_ERROR_SAMPLE = 512
+
+# parallel execution backends for the locality computation
+BACKENDS = ('thread', 'process')
+
+# row chunks submitted per worker, balances the load between workers
+CHUNKS_PER_WORKER = 4
+
+
+class Cancelled(Exception):
+    """Raised by a progress callback to stop a running computation"""
+
+
+class RowProgress(object):
+    """
+    Count the rows completed by one or more workers and report the done
+    fraction to a callback, which may raise Cancelled to stop the run.
+    """
+
+    def __init__(self, callback, total):
+        """
+        :param callback: callable receiving the done fraction between 0 and 1, or None
+        :param total: number of rows of the run
+        """
+        self.callback = callback
+        self.total = max(1, int(total))
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def advance(self, rows):
+        """Add rows to the count and call the callback"""
+        if self.callback is None:
+            return
+        with self.lock:
+            self.done += rows
+            fraction = min(1.0, self.done * 1.0 / self.total)
+        self.callback(fraction)
+
+
+def gaussian_cutoff(bandwidth, tolerance):
+    """
+    Distance where the gaussian weight falls below a relative tolerance,
+    e.g. 1e-2 is about 3 bandwidths and 1e-5 about 4.8 bandwidths.
+    :param bandwidth: bandwidth in meters
+    :param tolerance: relative tolerance between 0 and 1
+    :return: cutoff distance in meters
+    """
+    if not 0 < tolerance < 1:
+        raise Exception('Gaussian tolerance must be between 0 and 1!')
+    return bandwidth * np.sqrt(-2.0 * np.log(tolerance))
+
+
+def support_radius(bandwidth, weightmethod, tolerance=None):
+    """
+    Radius beyond which the weights are zero.
+    :param bandwidth: bandwidth in meters
+    :param weightmethod: 1-gaussian, 2-bi square and 3-moving window
+    :param tolerance: relative tolerance to truncate the gaussian, None for the exact kernel
+    :return: radius in meters, None if the kernel has infinite support
+    """
+    if weightmethod in COMPACT_KERNELS:
+        return bandwidth
+    if weightmethod == 1 and tolerance is not None:
+        return gaussian_cutoff(bandwidth, tolerance)
+    return None
+
+
+def kernel_weights(distance, bandwidth, weightmethod=1, out=None, tolerance=None):
+    """
+    Apply the neighborhood kernel to an array of distances.
+    :param distance: array like with distances in meters
+    :param bandwidth: bandwidth in meters selected to perform neighborhood
+    :param weightmethod: method to be used: 1-gaussian, 2-bi square and 3-moving window
+    :param out: optional float array to write the weights to, may be distance itself
+    :param tolerance: gaussian weights below this relative tolerance are set to zero
+    :return: array of weights with the same shape as distance
+    """
+    distance = np.asarray(distance, dtype=float)
+    if out is None:
+        out = np.empty_like(distance)
+    outside = None
+    if weightmethod in COMPACT_KERNELS:
+        outside = distance > bandwidth
+
+    if weightmethod == 1:
+        np.divide(distance, bandwidth, out=out)
+        np.multiply(out, out, out=out)
+        np.multiply(out, -0.5, out=out)
+        np.exp(out, out=out)
+        if tolerance is not None:
+            out[out < tolerance] = 0
+
+    elif weightmethod == 2:
+        np.divide(distance, bandwidth, out=out)
+        np.multiply(out, out, out=out)
+        np.subtract(1, out, out=out)
+        np.multiply(out, out, out=out)
+        out[outside] = 0
+
+    elif weightmethod == 3:
+        out[...] = 1
+        out[outside] = 0
+
+    else:
+        raise Exception('Invalid weight method selected!')
+
+    return out
+
+
+def neighbor_index(location):
+    """
+    Build a KD-tree over the tract coordinates.
+    :param location: 2d array like with x and y coordinates of each tract
+    :return: scipy cKDTree
+    """
+    return cKDTree(np.asarray(location, dtype=float))
+
+
+def neighbor_distances(location, radius, tree=None, workers=1):
+    """
+    Find the neighbors inside a radius of each tract with a KD-tree. Pairs
+    and their distances are collected by scipy in C straight to csr layout.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param radius: search radius in meters
+    :param tree: optional KD-tree built with neighbor_index()
+    :param workers: number of threads searching row chunks
+    :return: tuple (distance, indices, indptr) in csr layout, each tract includes itself
+    """
+    location = np.asarray(location, dtype=float)
+    n_local = location.shape[0]
+    if tree is None:
+        tree = neighbor_index(location)
+
+    def search(start, stop):
+        rows = tree if stop - start == n_local else neighbor_index(location[start:stop])
+        return rows.sparse_distance_matrix(tree, radius, output_type='coo_matrix').tocsr()
+
+    # the search releases the GIL, row chunks run on threads
+    workers = max(1, int(workers))
+    if workers == 1 or n_local < 2 * workers:
+        distance = search(0, n_local)
+    else:
+        step = -(-n_local // workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(lambda start: search(start, min(start + step, n_local)),
+                                  range(0, n_local, step)))
+        distance = vstack(parts, format='csr')
+    return distance.data, distance.indices, distance.indptr
+
+
+def neighbor_weights(location, bandwidth, weightmethod, tree=None, workers=1, tolerance=None):
+    """
+    Compute the sparse weights of a compact (or truncated gaussian) kernel
+    visiting only the neighbors inside the kernel support of each tract.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param bandwidth: bandwidth for neighborhood in meters
+    :param weightmethod: 1 for truncated gaussian, 2 for bi-square and 3 for moving window
+    :param tree: optional KD-tree built with neighbor_index()
+    :param workers: number of threads used by the neighbor search
+    :param tolerance: relative tolerance of the truncated gaussian
+    :return: n x n scipy csr_matrix with the weights
+    """
+    radius = support_radius(bandwidth, weightmethod, tolerance)
+    if radius is None:
+        raise Exception('Spatial index requires bi-square, moving window or truncated gaussian weights!')
+    distance, indices, indptr = neighbor_distances(location, radius, tree, workers)
+    weight = kernel_weights(distance, bandwidth, weightmethod, out=distance, tolerance=tolerance)
+    n_local = len(indptr) - 1
+    return csr_matrix((weight, indices, indptr), shape=(n_local, n_local))
+
+
+def locality_matrix_kdtree(location, pop, bandwidth, weightmethod, tree=None, workers=1,
+                           tolerance=None, weight_sum=None, out=None, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Compute the local population intensity for all groups using a KD-tree,
+    only neighbors inside the bandwidth are visited (O(n.k) instead of O(n^2)).
+    :param location: 2d array like with x and y coordinates of each tract
+    :param pop: 2d array like with population of each group by tract
+    :param bandwidth: bandwidth for neighborhood in meters
+    :param weightmethod: 1 for truncated gaussian, 2 for bi-square and 3 for moving window
+    :param tree: optional KD-tree built with neighbor_index()
+    :param workers: number of threads used by the neighbor search
+    :param tolerance: relative tolerance of the truncated gaussian
+    :param weight_sum: optional n array to write the weight sum of each tract to
+    :param out: optional n x m array (or memmap) written by row blocks
+    :param block_size: rows written to out at once
+    :return: 2d array with population intensity for all groups
+    """
+    pop = np.asarray(pop, dtype=float)
+    weight = neighbor_weights(location, bandwidth, weightmethod, tree, workers, tolerance)
+    sums = np.asarray(weight.sum(axis=1))
+    if weight_sum is not None:
+        weight_sum[...] = sums.ravel()
+    if out is None:
+        locality = np.asarray(weight.dot(pop))
+        locality /= sums
+
+        # assign zero to negative values
+        locality[locality < 0] = 0
+        return locality
+
+    # the products of a row block are the same as the ones of the whole matrix
+    n_local = weight.shape[0]
+    block_size = max(1, int(block_size))
+    for start in range(0, n_local, block_size):
+        stop = min(start + block_size, n_local)
+        block = np.asarray(weight[start:stop].dot(pop))
+        block /= sums[start:stop]
+        block[block < 0] = 0
+        out[start:stop] = block
+    return out
+
+
+def _locality_rows(location, pop, bandwidth, weightmethod, block_size, start, stop, locality,
+                   tolerance=None, weight_sum=None, progress=None):
+    """Compute the intensity of rows start:stop block by block writing into locality"""
+    for bstart in range(start, stop, block_size):
+        bstop = min(bstart + block_size, stop)
+        weight = cdist(location[bstart:bstop], location)
+        kernel_weights(weight, bandwidth, weightmethod, out=weight, tolerance=tolerance)
+        sums = np.sum(weight, axis=1)
+        block = np.dot(weight, pop)
+        block /= sums[:, None]
+        if weight_sum is not None:
+            weight_sum[bstart:bstop] = sums
+
+        # assign zero to negative values
+        block[block < 0] = 0
+        locality[bstart:bstop] = block
+        if progress is not None:
+            progress.advance(bstop - bstart)
+
+
+def _row_chunks(n_local, block_size, workers):
+    """Split rows in chunks made of whole blocks so results match the serial path"""
+    n_blocks = -(-n_local // block_size)
+    per_chunk = max(1, -(-n_blocks // (workers * CHUNKS_PER_WORKER)))
+    step = per_chunk * block_size
+    return [(start, min(start + step, n_local)) for start in range(0, n_local, step)]
+
+
+def _attach_shared(name, shape, dtype=float):
+    """Attach an array to an existing shared memory block"""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _file_backed(array):
+    """Path of the file an array maps entirely, None if it is not a whole memmap"""
+    if not isinstance(array, np.memmap) or not array.filename or array.offset != 0:
+        return None
+    if not array.flags.c_contiguous or os.path.getsize(array.filename) != array.nbytes:
+        return None
+    return array.filename
+
+
+def _shared_rows(args):
+    """
+    Process pool worker, arrays are read from and written to shared memory,
+    the result is written straight to its memmap file when it has one.
+    """
+    names, shapes, dtypes, bandwidth, weightmethod, block_size, start, stop, tolerance, path = args
+    shms = []
+    arrays = []
+    try:
+        for name, shape, dtype in zip(names, shapes, dtypes):
+            if name is None:
+                arrays.append(np.memmap(path, dtype=dtype, mode='r+', shape=shape))
+            else:
+                shm, array = _attach_shared(name, shape, dtype)
+                shms.append(shm)
+                arrays.append(array)
+        location, pop, locality, weight_sum = arrays
+        _locality_rows(location, pop, bandwidth, weightmethod, block_size, start, stop, locality,
+                       tolerance, weight_sum)
+        if path is not None:
+            locality.flush()
+    finally:
+        # release the views before closing the blocks
+        location = pop = locality = weight_sum = arrays = None
+        for shm in shms:
+            shm.close()
+
+
+def _release_shared(shm):
+    shm.close()
+
+
+def _shared_locality(location, pop, bandwidth, weightmethod, block_size, chunks, workers,
+                     tolerance=None, dtype=float, weight_sum=None, progress=None, out=None):
+    """
+    Run the row chunks on a process pool sharing location, pop and the output.
+    A memmap out is written by the workers through its file, any other out is
+    filled from a shared memory output at the end.
+    """
+    from multiprocessing import shared_memory
+    n_local, n_group = location.shape[0], pop.shape[1]
+    path = None if out is None else _file_backed(out)
+    inputs = []
+    output = None
+    try:
+        for array in (location, pop):
+            shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=float, buffer=shm.buf)[...] = array
+            inputs.append(shm)
+        if path is not None:
+            locality = out
+            dtype = out.dtype
+        else:
+            itemsize = np.dtype(dtype).itemsize
+            output = shared_memory.SharedMemory(create=True,
+                                                size=max(1, n_local * n_group * itemsize))
+            locality = np.ndarray((n_local, n_group), dtype=dtype, buffer=output.buf)
+            # the output stays mapped while locality is alive, no copy is made
+            weakref.finalize(locality, _release_shared, output)
+
+        # weight sums are written to a scratch block copied at the end
+        sums = shared_memory.SharedMemory(create=True, size=max(1, n_local * 8))
+        inputs.append(sums)
+
+        names = [shm.name for shm in inputs[:2]] + [None if output is None else output.name,
+                                                    sums.name]
+        shapes = [location.shape, pop.shape, (n_local, n_group), (n_local,)]
+        dtypes = [float, float, np.dtype(dtype).str, float]
+        tasks = [(names, shapes, dtypes, bandwidth, weightmethod, block_size, start, stop, tolerance,
+                  path) for start, stop in chunks]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                _wait_chunks([pool.submit(_shared_rows, task) for task in tasks], chunks, progress)
+        finally:
+            if output is not None:
+                output.unlink()
+        if weight_sum is not None:
+            weight_sum[...] = np.ndarray((n_local,), dtype=float, buffer=sums.buf)
+    finally:
+        for shm in inputs:
+            shm.close()
+            shm.unlink()
+
+    if out is not None and locality is not out:
+        out[...] = locality
+        locality = out
+    return locality
+
+
+def process_backend_available():
+    """
+    Check if worker processes can run this package. Processes started by
+    spawn or forkserver (the default on Windows and macOS) run the executable
+    of multiprocessing, which inside QGIS is the QGIS application and not Python.
+    :return: True if the 'process' backend can be used
+    """
+    method = multiprocessing.get_start_method(allow_none=True)
+    if method is None:
+        method = multiprocessing.get_all_start_methods()[0]
+    if method == 'fork':
+        return True
+    from multiprocessing import spawn
+    # bytes on POSIX since Python 3.11
+    executable = os.fsdecode(spawn.get_executable() or b'')
+    return os.path.basename(executable).lower().startswith('python')
+
+
+def _wait_chunks(futures, chunks, progress=None):
+    """Wait for the chunk futures, reporting whole chunks, pending ones are cancelled on error"""
+    try:
+        index = dict((future, i) for i, future in enumerate(futures))
+        for future in as_completed(futures):
+            future.result()
+            if progress is not None:
+                start, stop = chunks[index[future]]
+                progress.advance(stop - start)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def locality_matrix(location, pop, bandwidth, weightmethod, block_size=DEFAULT_BLOCK_SIZE,
+                    spatial_index=False, workers=1, backend='thread', out=None, tolerance=None,
+                    dtype=float, weight_sum=None, progress=None):
+    """
+    Compute the local population intensity for all groups on row blocks of
+    tracts. Each distance block is computed once, the kernel is applied in
+    place and all groups are weighted with a single matrix product. Blocks
+    are always computed in double precision, dtype only sets the storage.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param pop: 2d array like with population of each group by tract
+    :param bandwidth: bandwidth for neighborhood in meters
+    :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+    :param block_size: number of tracts computed at once, bounds memory to block_size x n
+    :param spatial_index: use a KD-tree for compact kernels (bi-square and moving window)
+        and the truncated gaussian
+    :param workers: number of workers, row chunks are computed in parallel when above 1
+    :param backend: 'thread' (NumPy and BLAS release the GIL) or 'process' (inputs
+        and output shared through shared memory), threads are used instead of
+        processes inside an embedded interpreter, see process_backend_available()
+    :param out: optional n x m array (or memmap) to write the result to, every path
+        writes it by row blocks without a full size copy in memory
+    :param tolerance: gaussian weights below this relative tolerance are dropped
+    :param dtype: dtype of the result, float32 halves its memory
+    :param weight_sum: optional n array to write the weight sum of each tract to,
+        the denominator needed by locality_update()
+    :param progress: optional callable receiving the done fraction after each row
+        block, it may raise Cancelled to stop the run
+    :return: 2d array with population intensity for all groups
+    """
+    workers = max(1, int(workers))
+    if backend not in BACKENDS:
+        raise Exception('Invalid parallel backend selected!')
+    if backend == 'process' and not process_backend_available():
+        backend = 'thread'
+    radius = support_radius(bandwidth, weightmethod, tolerance)
+    if spatial_index and radius is not None:
+        locality = locality_matrix_kdtree(location, pop, bandwidth, weightmethod, workers=workers,
+                                          tolerance=tolerance, weight_sum=weight_sum, out=out,
+                                          block_size=block_size)
+        if progress is not None:
+            progress(1.0)
+        return locality.astype(dtype, copy=False) if out is None else locality
+
+    location = np.ascontiguousarray(location, dtype=float)
+    pop = np.ascontiguousarray(pop, dtype=float)
+    n_local = location.shape[0]
+    block_size = max(1, int(block_size))
+    chunks = _row_chunks(n_local, block_size, workers)
+    rows = RowProgress(progress, n_local)
+
+    if workers == 1 or len(chunks) == 1:
+        locality = np.empty((n_local, pop.shape[1]), dtype=dtype) if out is None else out
+        _locality_rows(location, pop, bandwidth, weightmethod, block_size, 0, n_local, locality,
+                       tolerance, weight_sum, rows)
+    elif backend == 'thread':
+        locality = np.empty((n_local, pop.shape[1]), dtype=dtype) if out is None else out
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_locality_rows, location, pop, bandwidth, weightmethod,
+                                   block_size, start, stop, locality, tolerance, weight_sum, rows)
+                       for start, stop in chunks]
+            _wait_chunks(futures, chunks)
+    else:
+        locality = _shared_locality(location, pop, bandwidth, weightmethod, block_size, chunks,
+                                    workers, tolerance, dtype if out is None else out.dtype,
+                                    weight_sum, rows, out)
+
+    return locality
+
+
+def kernel_columns(location, rows, bandwidth, weightmethod, tolerance=None):
+    """
+    Weights between every tract and the tracts in rows, the columns of the
+    (symmetric) weight matrix.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param rows: indices of the k tracts
+    :param bandwidth: bandwidth for neighborhood in meters
+    :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+    :param tolerance: relative tolerance of the truncated gaussian
+    :return: n x k array
+    """
+    location = np.asarray(location, dtype=float)
+    weight = cdist(location, location[np.asarray(rows)])
+    return kernel_weights(weight, bandwidth, weightmethod, out=weight, tolerance=tolerance)
+
+
+def locality_update(location, locality, weight_sum, rows, delta, bandwidth, weightmethod,
+                    tolerance=None):
+    """
+    Update the population intensity in place after the population of a few
+    tracts changed. Intensity is linear in pop, so only the k weight columns
+    of the changed tracts are needed, O(n.k) instead of O(n^2).
+    :param location: 2d array like with x and y coordinates of each tract
+    :param locality: n x m intensity (or memmap) to update
+    :param weight_sum: n array with the weight sums from locality_matrix()
+    :param rows: indices of the k changed tracts
+    :param delta: k x m array with new minus old population
+    :param bandwidth: bandwidth for neighborhood in meters
+    :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+    :param tolerance: relative tolerance of the truncated gaussian
+    :return: locality
+    """
+    weight = kernel_columns(location, rows, bandwidth, weightmethod, tolerance)
+    change = np.dot(weight, np.asarray(delta, dtype=float)) / np.asarray(weight_sum)[:, None]
+    block = np.asarray(locality, dtype=float) + change
+
+    # assign zero to negative values
+    block[block < 0] = 0
+    locality[...] = block
+    return locality
+
+
+def truncation_error(location, pop, bandwidth, tolerance, locality, sample=DEFAULT_ERROR_SAMPLE,
+                     seed=0, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Measure the error of a truncated gaussian intensity against the exact
+    kernel on a random sample of tracts (all tracts if fewer than sample).
+    The exact kernel is computed in place on row blocks of the sample.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param pop: 2d array like with population of each group by tract
+    :param bandwidth: bandwidth for neighborhood in meters
+    :param tolerance: relative tolerance used for the truncation
+    :param locality: intensity computed with the truncated gaussian
+    :param sample: maximum number of tracts checked
+    :param seed: random seed of the sample
+    :param block_size: sampled tracts computed at once, bounds memory to block_size x n
+    :return: dict with max_abs_error, max_rel_error, cutoff and rows_checked
+    """
+    location = np.asarray(location, dtype=float)
+    pop = np.asarray(pop, dtype=float)
+    n_local = location.shape[0]
+    if n_local > sample:
+        rows = np.sort(np.random.RandomState(seed).choice(n_local, sample, replace=False))
+    else:
+        rows = np.arange(n_local)
+
+    max_error = 0.0
+    scale = 0.0
+    block_size = max(1, int(block_size))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        weight = cdist(location[block], location)
+        kernel_weights(weight, bandwidth, 1, out=weight)
+        exact = np.dot(weight, pop)
+        exact /= np.sum(weight, axis=1)[:, None]
+        exact[exact < 0] = 0
+        error = np.fabs(np.asarray(locality[block], dtype=float) - exact)
+        max_error = max(max_error, float(np.max(error)))
+        scale = max(scale, float(np.max(exact)))
+    return dict(max_abs_error=max_error,
+                max_rel_error=max_error / scale if scale > 0 else 0.0,
+                cutoff=float(gaussian_cutoff(bandwidth, tolerance)),
+                rows_checked=int(len(rows)))
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Layer loader: ids, centroids and group populations read in one pass and
+ kept as a columnar snapshot of the layer until it changes. Tract points
+ are computed in bulk from WKB when shapely 2 is installed.
+"""
+from __future__ import absolute_import
+from builtins import object
+from builtins import str
+from qgis.core import QgsFeatureRequest, QgsGeometry
+import numpy as np
+
+try:
+    import shapely
+    if not hasattr(shapely, 'from_wkb'):
+        shapely = None      # vectorized functions need shapely 2
+except ImportError:
+    shapely = None
+
+# representative point of each tract
+POINT_METHODS = ('centroid', 'point_on_surface')
+
+
+def _number(value):
+    """Attribute value as float, NULL and non numeric values are read as zero population"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _grow(array, size):
+    """Return a copy of array with size rows, keeping the existing rows"""
+    grown = np.empty((size,) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+def _point(geometry, point='centroid'):
+    """Representative point of a QgsGeometry as (x, y), (0, 0) for empty geometries"""
+    if point == 'point_on_surface':
+        xy = geometry.pointOnSurface().asPoint()
+    else:
+        xy = geometry.centroid().asPoint()
+    return xy.x(), xy.y()
+
+
+def representative_points(wkb, point='centroid'):
+    """
+    Compute the representative point of many geometries at once with shapely.
+    Geometries GEOS can not read (e.g. curved types) are computed one by one
+    by QGIS instead.
+    :param wkb: sequence of WKB bytes, one per tract
+    :param point: one of POINT_METHODS
+    :return: contiguous n x 2 float array with x and y
+    """
+    geoms = shapely.from_wkb(np.asarray(wkb, dtype=object), on_invalid='ignore')
+    if point == 'point_on_surface':
+        points = shapely.point_on_surface(geoms)
+    else:
+        points = shapely.centroid(geoms)
+
+    # empty geometries are (0, 0) as on the per feature path
+    location = np.zeros((len(points), 2))
+    valid = ~(shapely.is_missing(points) | shapely.is_empty(points))
+    location[valid] = shapely.get_coordinates(points[valid])
+    for row in np.flatnonzero(shapely.is_missing(geoms)):
+        geometry = QgsGeometry()
+        geometry.fromWkb(wkb[row])
+        location[row] = _point(geometry, point)
+    return location
+
+
+class LayerSnapshot(object):
+    """
+    Columnar copy of a layer: feature ids, geometries, raw attribute values
+    and representative points as arrays. The first read fetches geometries
+    with the requested fields in one pass and fixes the row order, fields
+    asked later are read without geometry and placed by feature id, so row
+    i always refers to the same feature.
+    """
+
+    def __init__(self, layer):
+        """
+        :param layer: QgsVectorLayer to read
+        """
+        self.layer = layer
+        self.fids = None            # feature ids in row order
+        self.rows = {}              # feature id to row
+        self.geometries = []        # QgsGeometry by row
+        self.values = {}            # field name to raw values by row
+        self.points = {}            # point method to n x 2 array
+        self.connections = []       # layer signals connected to invalidate the snapshot
+
+    def read(self, names):
+        """
+        Read the fields not in the snapshot yet in a single feature request.
+        :param names: list of field names
+        """
+        names = [name for name in dict.fromkeys(names) if name not in self.values]
+        first = self.fids is None
+        if not names and not first:
+            return
+        fields = self.layer.fields()
+        index = [fields.indexOf(name) for name in names]
+        missing = [name for name, i in zip(names, index) if i < 0]
+        if missing:
+            raise ValueError('Fields not found: %s!' % ', '.join(missing))
+
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes(index)
+        if not first:
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+
+        # feature count may be unknown (-1) or stale for some providers, arrays grow if needed
+        size = max(0, self.layer.featureCount()) if first else len(self.fids)
+        fids = np.empty(size, dtype=np.int64)
+        columns = [np.empty(size, dtype=object) for _ in names]
+
+        row = 0
+        for feat in self.layer.getFeatures(request):
+            if first:
+                if row == size:
+                    size = max(16, 2 * size)
+                    fids = _grow(fids, size)
+                    columns = [_grow(column, size) for column in columns]
+                fids[row] = feat.id()
+                self.geometries.append(feat.geometry())
+                target = row
+                row += 1
+            else:
+                target = self.rows.get(feat.id())
+                if target is None:
+                    continue
+            attributes = feat.attributes()
+            for column, i in zip(columns, index):
+                column[target] = attributes[i]
+
+        if first:
+            self.fids = fids[:row]
+            self.rows = dict((fid, r) for r, fid in enumerate(self.fids.tolist()))
+            columns = [column[:row] for column in columns]
+        self.values.update(zip(names, columns))
+
+    def numbers(self, name):
+        """Float values of a field, NULL and non numeric values are read as zero"""
+        self.read([name])
+        return np.array([_number(value) for value in self.values[name]], dtype=float)
+
+    def strings(self, name):
+        """Text values of a field"""
+        self.read([name])
+        return np.asarray([str(value) for value in self.values[name]])
+
+    def location(self, point='centroid', vectorized=True):
+        """
+        Representative point of each feature, computed once per point method.
+        With shapely 2 installed they are computed in bulk from WKB, otherwise
+        one feature at a time by QGIS.
+        :param point: one of POINT_METHODS
+        :param vectorized: compute points with shapely when it is installed
+        :return: n x 2 float array, must not be modified
+        """
+        if point not in POINT_METHODS:
+            raise ValueError('Point must be one of %s!' % ', '.join(POINT_METHODS))
+        self.read([])
+        if point not in self.points:
+            if vectorized and shapely is not None:
+                location = representative_points([bytes(g.asWkb()) for g in self.geometries], point)
+            else:
+                location = np.empty((len(self.geometries), 2))
+                for row, geometry in enumerate(self.geometries):
+                    location[row] = _point(geometry, point)
+            self.points[point] = location
+        return self.points[point]
+
+
+class SnapshotCache(object):
+    """
+    Snapshots of the layers read in a session. A snapshot is dropped as soon
+    as its layer is edited, committed, filtered, changes fields or is removed.
+    """
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def get(self, layer):
+        """Return the snapshot of a layer, a new empty one if missing or dropped"""
+        key = layer.id()
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            snapshot = LayerSnapshot(layer)
+
+            def drop(*args):
+                self.invalidate(key)
+            for signal in (layer.dataChanged, layer.afterCommitChanges, layer.updatedFields,
+                           layer.subsetStringChanged, layer.willBeDeleted):
+                signal.connect(drop)
+                snapshot.connections.append((signal, drop))
+            self.snapshots[key] = snapshot
+        return snapshot
+
+    def invalidate(self, key):
+        """Drop the snapshot of a layer id and disconnect its signals"""
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot is None:
+            return
+        for signal, slot in snapshot.connections:
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass    # layer already deleted
+        snapshot.connections = []
+
+    def clear(self):
+        """Drop all snapshots"""
+        for key in list(self.snapshots):
+            self.invalidate(key)
+
+
+def load_features(layer, id_field, group_fields, point='centroid', vectorized=True, snapshot=None):
+    """
+    Read ids, centroids and group populations of a layer with one feature
+    request fetching only the id and group attributes, or none at all if
+    the snapshot already holds them. Each centroid is computed once. With
+    shapely 2 installed they are computed in bulk from WKB, otherwise each
+    feature is computed by QGIS.
+
+    Row i of every returned array comes from the same feature, the i-th of
+    the snapshot first pass, so ids, coordinates, populations and feature
+    ids always refer to the same tract whatever order the provider returns
+    features in.
+    :param layer: QgsVectorLayer with the tracts
+    :param id_field: name of the id field
+    :param group_fields: list of group field names
+    :param point: tract location, 'centroid' or 'point_on_surface'
+    :param vectorized: compute points with shapely when it is installed
+    :param snapshot: LayerSnapshot of the layer to reuse, a temporary one if None
+    :return: tuple (fids, ids, location, pop) with n feature ids, n string ids,
+        n x 2 and n x m float arrays
+    """
+    if point not in POINT_METHODS:
+        raise ValueError('Point must be one of %s!' % ', '.join(POINT_METHODS))
+    if snapshot is None:
+        snapshot = LayerSnapshot(layer)
+    snapshot.read([id_field] + list(group_fields))
+
+    pop = np.empty((len(snapshot.fids), len(group_fields)))
+    for col, name in enumerate(group_fields):
+        pop[:, col] = snapshot.numbers(name)
+    location = np.array(snapshot.location(point, vectorized))
+    return snapshot.fids.copy(), snapshot.strings(id_field), location, pop
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Local and global segregation measures on plain arrays. When locality is
+ None or empty the non spatial version is computed with the raw data.
+"""
+from __future__ import absolute_import
+from builtins import range
+import numpy as np
+
+
+def _is_spatial(locality):
+    return locality is not None and len(locality) != 0
+
+
+def _row_blocks(n_local, block_size=None):
+    """Row ranges to process, a single block when block_size is None"""
+    if block_size is None:
+        return [(0, n_local)]
+    block_size = max(1, int(block_size))
+    return [(start, min(start + block_size, n_local)) for start in range(0, n_local, block_size)]
+
+
+def local_dissimilarity(pop, locality=None, block_size=None, out=None, dtype=float):
+    """
+    Compute local dissimilarity for all groups.
+    :param pop: 2d array like with population of each group by tract
+    :param locality: population intensity, None for the non spatial version
+    :param block_size: rows processed at once, all rows when None
+    :param out: optional n x 1 array (or memmap) to write the result to
+    :param dtype: dtype of the result when out is None
+    :return: n x 1 array
+    """
+    pop = np.asarray(pop, dtype=float)
+    n_local = pop.shape[0]
+    if out is None:
+        out = np.empty((n_local, 1), dtype=dtype)
+
+    # spatial version uses population intensity, non-spatial the raw data
+    base = locality if _is_spatial(locality) else pop
+    tm = np.sum(pop, axis=0) * 1.0 / np.sum(pop)
+    index_i = np.sum(tm * (1 - tm))
+    pop_total = np.sum(pop)
+
+    for start, stop in _row_blocks(n_local, block_size):
+        rows = np.asarray(base[start:stop], dtype=float)
+        pop_sum = np.sum(pop[start:stop], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tjm = rows * 1.0 / np.sum(rows, axis=1)[:, None]
+            local_diss = np.sum(np.fabs(tjm - tm) * pop_sum[:, None] / (2 * pop_total * index_i), axis=1)
+
+        # clear nan values
+        out[start:stop, 0] = np.nan_to_num(local_diss)
+    return out
+
+
+def global_dissimilarity(local_diss):
+    """Compute global dissimilarity summing up the local version"""
+    return np.sum(local_diss, dtype=np.float64)
+
+
+def exposure_pairs(n_group, pairs=None):
+    """
+    Group pairs (i, j) of the local exposure columns, exposure of group i to
+    group j or the isolation of group i when i == j.
+    :param n_group: number of groups
+    :param pairs: None or 'all' for every pair, 'isolation' for (i, i) only, an int r
+        for reference group r against every other group, or a list of (i, j)
+    :return: list of (i, j) tuples in output order
+    """
+    if pairs is None or pairs == 'all':
+        return [(i, j) for i in range(n_group) for j in range(n_group)]
+    if pairs == 'isolation':
+        return [(i, i) for i in range(n_group)]
+    if isinstance(pairs, (int, np.integer)):
+        pairs = [(pairs, j) for j in range(n_group) if j != pairs]
+
+    selected = []
+    for i, j in pairs:
+        pair = (int(i), int(j))
+        if not (0 <= pair[0] < n_group and 0 <= pair[1] < n_group):
+            raise ValueError('Invalid group pair: %s, %s' % pair)
+        if pair not in selected:
+            selected.append(pair)
+    return selected
+
+
+def exposure_blocks(pop, locality=None, pairs=None, block_size=None):
+    """
+    Compute the local exposure of the selected group pairs by row blocks,
+    so callers can consume it without keeping all rows.
+    :param pop: 2d array like with population of each group by tract
+    :param locality: population intensity, None for the non spatial version
+    :param pairs: group pairs, see exposure_pairs()
+    :param block_size: rows processed at once, all rows when None
+    :return: generator of (start, stop, block), block is (stop - start) x len(pairs)
+    """
+    pop = np.asarray(pop, dtype=float)
+    j, m = pop.shape
+    pairs = exposure_pairs(m, pairs)
+    first = np.array([p[0] for p in pairs], dtype=int)
+    second = np.array([p[1] for p in pairs], dtype=int)
+
+    # spatial version uses population intensity, non-spatial the raw data
+    base = locality if _is_spatial(locality) else pop
+    group_sum = np.sum(pop, axis=0)
+
+    for start, stop in _row_blocks(j, block_size):
+        rows = np.asarray(base[start:stop], dtype=float)
+        local_expo = _safe_divide(pop[start:stop], group_sum)
+        locality_rate = _safe_divide(rows, np.sum(rows, axis=1)[:, None])
+        yield start, stop, local_expo[:, first] * locality_rate[:, second]
+
+
+def local_exposure(pop, locality=None, block_size=None, out=None, dtype=float, pairs=None):
+    """
+    Compute the local exposure index of group m to group n.
+    in situations where m=n, then the result is the isolation index.
+    :param pop: 2d array like with population of each group by tract
+    :param locality: population intensity, None for the non spatial version
+    :param block_size: rows processed at once, all rows when None
+    :param out: optional n x len(pairs) array (or memmap) to write the result to
+    :param dtype: dtype of the result when out is None
+    :param pairs: group pairs to compute, all when None, see exposure_pairs()
+    :return: n x len(pairs) array, all pairs are ordered as (0,0), (0,1) ... (m,m)
+    """
+    pop = np.asarray(pop, dtype=float)
+    j, m = pop.shape
+    if out is None:
+        out = np.empty((j, len(exposure_pairs(m, pairs))), dtype=dtype)
+
+    for start, stop, exposure_rs in exposure_blocks(pop, locality, pairs, block_size):
+        out[start:stop] = exposure_rs
+    return out
+
+
+def global_exposure(local_exp, n_group, block_size=None):
+    """
+    Compute global exposure summing up the local version, in double
+    precision whatever the dtype of local_exp.
+    :param local_exp: local exposure from local_exposure()
+    :param n_group: number of groups
+    :param block_size: rows summed at once, all rows when None
+    :return: m x m array
+    """
+    global_exp = np.zeros(n_group * n_group)
+    for start, stop in _row_blocks(local_exp.shape[0], block_size):
+        global_exp += np.sum(np.asarray(local_exp[start:stop]), axis=0, dtype=np.float64)
+    return global_exp.reshape((n_group, n_group))
+
+
+def global_exposure_direct(pop, locality=None, block_size=None):
+    """
+    Compute global exposure without the n x m*m local version. The sum over
+    tracts of group i share times the locality rate of group j is the
+    product shares.T x rates, accumulated by row blocks in O(n.m) memory.
+    :param pop: 2d array like with population of each group by tract
+    :param locality: population intensity, None for the non spatial version
+    :param block_size: rows processed at once, all rows when None
+    :return: m x m array, the same as global_exposure(local_exposure(...))
+    """
+    pop = np.asarray(pop, dtype=float)
+    j, m = pop.shape
+
+    # spatial version uses population intensity, non-spatial the raw data
+    base = locality if _is_spatial(locality) else pop
+    group_sum = np.sum(pop, axis=0)
+
+    global_exp = np.zeros((m, m))
+    for start, stop in _row_blocks(j, block_size):
+        rows = np.asarray(base[start:stop], dtype=float)
+        share = _safe_divide(pop[start:stop], group_sum)
+        locality_rate = _safe_divide(rows, np.sum(rows, axis=1)[:, None])
+        global_exp += np.dot(share.T, locality_rate)
+    return global_exp
+
+
+def local_entropy(pop, locality=None, block_size=None, out=None, dtype=float):
+    """
+    Compute local entropy score for a unit area Ei (diversity).
+    :param pop: 2d array like with population of each group by tract
+    :param locality: population intensity, None for the non spatial version
+    :param block_size: rows processed at once, all rows when None
+    :param out: optional n x 1 array (or memmap) to write the result to
+    :param dtype: dtype of the result when out is None
+    :return: n x 1 array
+    """
+    pop = np.asarray(pop, dtype=float)
+    n_local = pop.shape[0]
+    if out is None:
+        out = np.empty((n_local, 1), dtype=dtype)
+
+    # spatial version uses population intensity, non-spatial the raw data
+    base = locality if _is_spatial(locality) else pop
+
+    for start, stop in _row_blocks(n_local, block_size):
+        rows = np.asarray(base[start:stop], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proportion = rows / np.sum(rows, axis=1)[:, None]
+            entropy = proportion * np.log(1 / proportion)
+
+        # clear nan and inf values, sum line
+        entropy[np.isnan(entropy)] = 0
+        entropy[np.isinf(entropy)] = 0
+        out[start:stop, 0] = np.sum(entropy, axis=1)
+    return out
+
+
+def global_entropy(pop):
+    """Compute the global entropy score E (diversity), metropolitan area's entropy score"""
+    pop = np.asarray(pop, dtype=float)
+    prop = np.sum(pop, axis=0) / np.sum(pop)
+    return np.sum(prop * np.log(1 / prop))
+
+
+def local_indexh(pop, local_entro, global_entro):
+    """
+    Compute the local entropy index H for all localities.
+    :param pop: 2d array like with population of each group by tract
+    :param local_entro: local entropy from local_entropy()
+    :param global_entro: global entropy from global_entropy()
+    :return: n x 1 array with the dtype of local_entro
+    """
+    local_entro = np.asarray(local_entro)
+    pop_sum = np.sum(np.asarray(pop, dtype=float), axis=1).reshape((-1, 1))
+    et = global_entro * np.sum(pop_sum)
+    eei = global_entro - local_entro.astype(float)
+    return (pop_sum * eei / et).astype(local_entro.dtype, copy=False)
+
+
+def global_indexh(local_h):
+    """Compute global index H summing up the local version"""
+    return np.sum(local_h, dtype=np.float64)
+
+
+# measures computed by fused_local_measures()
+FUSED_MEASURES = ('dissimilarity', 'exposure', 'entropy', 'indexh')
+
+# rows between progress reports when no block size is given
+PROGRESS_ROWS = 4096
+
+
+def _safe_divide(a, b):
+    """Divide a by b broadcasting, zero where b is zero"""
+    out = np.zeros(np.broadcast(a, b).shape)
+    np.divide(a, b, out=out, where=(b != 0))
+    return out
+
+
+def fused_local_measures(pop, locality=None, selected=FUSED_MEASURES, block_size=None, out=None,
+                         dtype=float, progress=None, pairs=None):
+    """
+    Compute the selected local measures walking pop and locality once per
+    row block. Row sums, proportions and group shares are derived once and
+    shared by all measures, tracts without population give zero instead of
+    nan/inf values. Results are the same of the single measure functions.
+    :param pop: 2d array like with population of each group by tract
+    :param locality: population intensity, None for the non spatial version
+    :param selected: names from FUSED_MEASURES
+    :param block_size: rows processed at once, all rows when None
+    :param out: optional dict of {name: array (or memmap)} to write the results to
+    :param dtype: dtype of the results not given in out
+    :param progress: optional callable receiving the done fraction after each row
+        block, it may raise intensity.Cancelled to stop the run
+    :param pairs: group pairs of the exposure, all when None, see exposure_pairs()
+    :return: dict of {name: array}, n x len(pairs) for exposure and n x 1 for the others
+    """
+    unknown = [name for name in selected if name not in FUSED_MEASURES]
+    if unknown:
+        raise ValueError('Invalid measures selected: %s' % ', '.join(unknown))
+    pop = np.asarray(pop, dtype=float)
+    n_local, m = pop.shape
+    pairs = exposure_pairs(m, pairs)
+    first = np.array([p[0] for p in pairs], dtype=int)
+    second = np.array([p[1] for p in pairs], dtype=int)
+    out = dict(out or {})
+    for name in selected:
+        if name not in out:
+            out[name] = np.empty((n_local, len(pairs) if name == 'exposure' else 1), dtype=dtype)
+
+    # spatial version uses population intensity, non-spatial the raw data
+    base = locality if _is_spatial(locality) else pop
+    group_sum = np.sum(pop, axis=0)
+    pop_total = np.sum(group_sum)
+    tm = _safe_divide(group_sum, pop_total)
+    index_i = np.sum(tm * (1 - tm))
+    diss_scale = 2 * pop_total * index_i
+    if 'indexh' in selected:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            global_entro = global_entropy(pop)
+        et = global_entro * pop_total
+    if progress is not None and block_size is None:
+        block_size = PROGRESS_ROWS
+
+    for start, stop in _row_blocks(n_local, block_size):
+        rows = np.asarray(base[start:stop], dtype=float)
+        pop_rows = pop[start:stop]
+        pop_sum = np.sum(pop_rows, axis=1)
+        row_total = np.sum(rows, axis=1)
+        proportion = _safe_divide(rows, row_total[:, None])
+
+        if 'dissimilarity' in selected:
+            local_diss = np.sum(np.fabs(proportion - tm), axis=1) * pop_sum
+            local_diss[row_total == 0] = 0
+            out['dissimilarity'][start:stop, 0] = _safe_divide(local_diss, diss_scale)
+
+        if 'exposure' in selected:
+            local_expo = _safe_divide(pop_rows, group_sum)
+            out['exposure'][start:stop] = local_expo[:, first] * proportion[:, second]
+
+        if 'entropy' in selected or 'indexh' in selected:
+            log_prop = np.zeros_like(proportion)
+            np.log(proportion, out=log_prop, where=(proportion > 0))
+            entropy = -np.sum(proportion * log_prop, axis=1)
+            if 'entropy' in selected:
+                out['entropy'][start:stop, 0] = entropy
+            if 'indexh' in selected:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    out['indexh'][start:stop, 0] = pop_sum * (global_entro - entropy) / et
+        if progress is not None:
+            progress(stop * 1.0 / n_local)
+
+    return dict((name, out[name]) for name in selected)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Out-of-core storage: large intermediates are kept on numpy.memmap files in
+ a scratch directory and processed in row blocks sized by a memory budget.
+"""
+from __future__ import absolute_import
+from builtins import object
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# default memory budget in bytes for one row block
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+def rows_for_budget(memory_budget, row_items, itemsize=8, workers=1):
+    """
+    Number of rows that fit in the memory budget.
+    :param memory_budget: bytes available for one block on each worker together
+    :param row_items: number of values held in memory per row
+    :param itemsize: bytes per value
+    :param workers: blocks processed at the same time
+    :return: rows per block, at least one
+    """
+    row_bytes = max(1, int(row_items) * itemsize * max(1, int(workers)))
+    return max(1, int(memory_budget) // row_bytes)
+
+
+class ScratchSpace(object):
+    """Directory of memory-mapped arrays removed on cleanup()"""
+
+    def __init__(self, parent=None):
+        """
+        :param parent: directory where the scratch folder is created, system
+            temporary directory when None
+        """
+        self.path = tempfile.mkdtemp(prefix='segreg_', dir=parent)
+        self.arrays = {}
+        self.stale = []
+
+    def array(self, name, shape, dtype=float):
+        """
+        Create (or replace) a writable memory-mapped array. Each call gets a
+        new file, the previous array of the same name may still be mapped.
+        :param name: array name, used as file name prefix
+        :param shape: array shape
+        :param dtype: numpy dtype
+        :return: numpy.memmap
+        """
+        self.release(name)
+        handle, filename = tempfile.mkstemp(prefix='%s_' % name, suffix='.dat', dir=self.path)
+        os.close(handle)
+        array = np.memmap(filename, dtype=dtype, mode='w+', shape=tuple(shape))
+        self.arrays[name] = filename
+        return array
+
+    def release(self, name):
+        """
+        Delete the file of an array. Files still mapped can not be removed on
+        Windows, they are retried on the next release and on cleanup().
+        """
+        filename = self.arrays.pop(name, None)
+        if filename is not None:
+            self.stale.append(filename)
+        stale, self.stale = self.stale, []
+        for filename in stale:
+            if os.path.exists(filename):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    self.stale.append(filename)
+
+    def cleanup(self):
+        """Remove the scratch directory and all arrays"""
+        self.arrays = {}
+        self.stale = []
+        shutil.rmtree(self.path, ignore_errors=True)
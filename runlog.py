@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Run log: wall time of each stage with the input sizes, saved as JSON.
+"""
+from __future__ import absolute_import
+from builtins import object
+from contextlib import contextmanager
+import json
+import time
+import numpy as np
+
+from .intensity import Cancelled
+
+
+def _jsonable(value):
+    """Convert numpy scalars and arrays, other objects are written as text"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return str(value)
+
+
+class RunLog(object):
+    """Timings of the stages of a run and the context they ran on"""
+
+    def __init__(self, **context):
+        """
+        :param context: run inputs, e.g. layer name, number of tracts and groups
+        """
+        self.context = dict(context)
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.stages = []
+
+    def update(self, **context):
+        """Add or replace context values"""
+        self.context.update(context)
+
+    def record(self, name, seconds, status='ok', **info):
+        """
+        Append a stage timed by the caller.
+        :param name: stage name
+        :param seconds: wall time in seconds
+        :param status: 'ok', 'cancelled' or 'failed'
+        :param info: stage inputs, e.g. bandwidth and kernel
+        :return: the stage entry
+        """
+        entry = dict(stage=name, seconds=seconds, status=status,
+                     finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        entry.update(info)
+        self.stages.append(entry)
+        return entry
+
+    @contextmanager
+    def stage(self, name, **info):
+        """Context manager timing a stage, the status tells if it raised"""
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except Cancelled:
+            status = 'cancelled'
+            raise
+        except Exception:
+            status = 'failed'
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, status, **info)
+
+    def total(self):
+        """Sum of the stage times in seconds"""
+        return sum(entry['seconds'] for entry in self.stages)
+
+    def summary(self):
+        """Short text with one line per stage and the total"""
+        lines = []
+        for entry in self.stages:
+            info = ', '.join('%s=%s' % (k, entry[k]) for k in sorted(entry)
+                             if k not in ('stage', 'seconds', 'status', 'finished'))
+            status = '' if entry['status'] == 'ok' else ' (%s)' % entry['status']
+            line = '%-14s %9.3fs%s  %s' % (entry['stage'], entry['seconds'], status, info)
+            lines.append(line.rstrip())
+        lines.append('%-14s %9.3fs' % ('total', self.total()))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """Write the log to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump(dict(started=self.started, context=self.context, stages=self.stages,
+                           total_seconds=self.total()), f, indent=1, default=_jsonable)
@@ -24,19 +24,30 @@ from __future__ import absolute_import
 from builtins import str
 from builtins import range
 from builtins import object
-from qgis.core import Qgis, QgsProject, QgsVectorLayer, QgsField, QgsVectorLayerUtils
+from qgis.core import (Qgis, QgsApplication, QgsFeature, QgsProject, QgsTask, QgsVectorLayer,
+                       QgsField)
 from qgis.gui import QgsMessageBar
 from qgis.PyQt.QtGui import QIcon, QStandardItem, QStandardItemModel
 from qgis.PyQt.QtWidgets import QAction, QCheckBox, QMessageBox, QFileDialog, QAbstractItemView, QListView
 from qgis.PyQt.QtCore import QSettings, QTranslator, qVersion, QCoreApplication, Qt, QFileInfo, QVariant
 import os.path
+import time
 import numpy as np
-from scipy.spatial.distance import cdist
 
 # Initialize Qt resources from file resources.py
 from . import resources
 # Import the code for the dialog
 from .segreg_dialog import SegregDialog
+# Import the headless segregation engine
+from .cache import DEFAULT_CACHE_SIZE, ColumnCache
+from .engine import ALL_MEASURES, LOCAL_MEASURES, MEASURE_ATTRIBUTES, SegregEngine
+from .export import write_local, write_long
+from .intensity import DEFAULT_BLOCK_SIZE, Cancelled, kernel_weights
+from .loader import SnapshotCache, load_features
+from .measures import exposure_pairs
+from .outofcore import DEFAULT_MEMORY_BUDGET
+from .runlog import RunLog
+from .sweep import save_sweep
 
 
 class Segreg(object):
@@ -80,6 +91,7 @@ class Segreg(object):
         self.lvGroups.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.confirmedLayerName = None
         self.dlg.plainTextEdit.setReadOnly(True)
+        self.infoText = self.dlg.plainTextEdit.toPlainText()
         self.measuresEmpty = True
 
         # Segregation measures attributes
@@ -92,6 +104,35 @@ class Segreg(object):
         self.n_group = 0                        # number of groups (attributeMatrix.shape[1] - 4)
         self.costMatrix = []                    # scipy cdist distance matrix
         self.tract_id = []                      # tract ids in string format
+        self.block_size = DEFAULT_BLOCK_SIZE    # tracts computed at once by the intensity engine
+        self.spatial_index = False              # use KD-tree neighbors for compact kernels
+        self.workers = 1                        # threads of the intensity engine
+        self.reuse_weights = False              # keep weights between runs and save .npz sidecar
+        self.weightMatrix = None                # WeightMatrix of the last intensity run
+        self.weightSidecar = None               # source file of confirmed layer for the sidecar
+        self.keep_sweep_locality = False        # keep per-tract intensity of each swept bandwidth
+        self.out_of_core = False                # keep large arrays on memmap files in scratch dir
+        self.memory_budget = DEFAULT_MEMORY_BUDGET  # bytes per row block in out-of-core mode
+        self.scratch_dir = None                 # parent of scratch files, system temp if None
+        self.gauss_tolerance = None             # drop gaussian weights below it, None for exact
+        self.truncationError = None             # error of the truncated gaussian on the last run
+        self.dtype = np.float64                 # storage of intensity and local measures, or float32
+        self.live_update = False                # patch results when group values are edited
+        self.liveLayer = None                   # layer connected for live updates
+        self.featureRows = {}                   # feature id to tract row of the confirmed layer
+        self.groupFields = {}                   # field index to group column of the confirmed layer
+        self.tract_point = 'centroid'           # tract location, 'centroid' or 'point_on_surface'
+        self.float_format = None                # exported values format e.g. '%.6f', exact if None
+        self.exposure_pairs = None              # local exposure pairs, all, 'isolation', group or [(i, j)]
+        self.exposure_long = False              # also save every exposure pair in long format
+        self.cache_dir = ''                     # result cache, '' in the QGIS profile, None disables
+        self.cache_size = DEFAULT_CACHE_SIZE    # size limit of the result cache in bytes
+        self.columnCache = ColumnCache()        # intensity columns and weights kept in the session
+        self.snapshots = SnapshotCache()        # layers read in the session, dropped on edits
+        self.engine = None                      # SegregEngine of the confirmed input
+        self.task = None                        # background QgsTask running, one at a time
+        self.pendingChanges = {}                # live edits received while a task was running
+        self.runLog = RunLog()                  # stage timings of the confirmed input
 
         # Local and global internals
         self.local_dissimilarity = []
@@ -102,6 +143,8 @@ class Segreg(object):
         self.global_exposure = []
         self.global_entropy = []
         self.global_indexh = []
+        self.sweepResults = []                  # global measures by weight method and bandwidth
+        self.sweepLocality = None               # intensity by (weight method, bandwidth) if kept
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -204,6 +247,9 @@ class Segreg(object):
         # remove the toolbar
         del self.toolbar
 
+        # stop following the layers read in this session
+        self.snapshots.clear()
+
     def clearVariables(self):
         """clear local lists and variables"""
         # clear input tables
@@ -214,6 +260,8 @@ class Segreg(object):
         self.n_location = 0
         self.n_group = 0
         self.tract_id = []
+        self.weightMatrix = None
+        self.weightSidecar = None
         self.selectedFields = []
         self.layers = []
 
@@ -235,6 +283,18 @@ class Segreg(object):
         self.global_exposure = []
         self.global_entropy = []
         self.global_indexh = []
+        self.sweepResults = []
+        self.sweepLocality = None
+
+        # stop the running task, release engine and out-of-core scratch files.
+        # an engine still used by a task is closed when the task finishes
+        self.disconnectLiveUpdate()
+        self.pendingChanges = {}
+        if self.task is not None:
+            self.task.cancel()
+        elif self.engine is not None:
+            self.engine.close()
+        self.engine = None
 
     def addLayers(self):
         """
@@ -305,6 +365,10 @@ class Segreg(object):
 
     def confirmButton(self):
         """Populate local variables (attributes matrix) with selected fields"""
+        # the engine of the confirmed input is in use by the running task
+        if self.taskRunning():
+            return
+        start = time.perf_counter()
         # get layer and fields from combo box items
         layerName = self.dlg.cbLayers.currentText()
         selectedLayer = QgsProject.instance().mapLayersByName(layerName)[0]
@@ -312,37 +376,31 @@ class Segreg(object):
         # to be used later to save results as shapefile
         self.confirmedLayerName = layerName
 
-        # populate tract_id data
-        id_name = self.dlg.cbId.currentText()
-        # id_values = selectedLayer.getValues(id_name)[0]
-        id_values = QgsVectorLayerUtils.getValues(selectedLayer, id_name)[0]
-        id_values = [str(x) for x in id_values]
-        self.tract_id = np.asarray(id_values)
-        self.tract_id = self.tract_id.reshape((len(id_values), 1))
-
-        # return x and y from polygons centroids
-        x_cord = [feat.geometry().centroid().asPoint().x() for feat in selectedLayer.getFeatures()]
-        x_cord = np.reshape(x_cord, (len(x_cord), 1))
-        y_cord = [feat.geometry().centroid().asPoint().y() for feat in selectedLayer.getFeatures()]
-        y_cord = np.reshape(y_cord, (len(y_cord), 1))
-
-        # populate groups data based on selected fields list
-        groups = []
-        for i in field_names:
-            # getDoubleValues for float type
-            values = QgsVectorLayerUtils.getDoubleValues(selectedLayer, i)[0]
-            group = [float(x) for x in values]
-            groups.append(group)
-        groups = np.asarray(groups).T
+        # weights sidecar is saved next to file based layers only
+        source = selectedLayer.source().split('|')[0]
+        self.weightSidecar = source if os.path.isfile(source) else None
 
         # check if fields were selected
-        if len(groups) == 0:
+        if len(field_names) == 0:
             QMessageBox.critical(None, "Error", 'No data selected!')
             self.dlg.tabWidget.setTabEnabled(1, False)
             return
 
+        # ids, centroids and groups from the layer snapshot, read in one pass
+        # over the layer only if missing or edited since, rows are aligned
+        id_name = self.dlg.cbId.currentText()
+        snapshot = self.snapshots.get(selectedLayer)
+        feature_ids, id_values, location, groups = load_features(selectedLayer, id_name, field_names,
+                                                                 self.tract_point, snapshot=snapshot)
+        self.tract_id = id_values.reshape((len(id_values), 1))
+
+        # map features and group fields to rows and columns for live updates
+        self.featureRows = dict((fid, row) for row, fid in enumerate(feature_ids.tolist()))
+        self.groupFields = dict((selectedLayer.fields().indexOf(name), col)
+                                for col, name in enumerate(field_names))
+
         # concatenate values and populate attribute matrix
-        data = np.concatenate((x_cord, y_cord, groups), axis=1)
+        data = np.concatenate((location, groups), axis=1)
         self.attributeMatrix = np.asmatrix(data)
         n = self.attributeMatrix.shape[1]
         self.location = self.attributeMatrix[:, 0:2]
@@ -353,12 +411,81 @@ class Segreg(object):
         self.n_location = self.attributeMatrix.shape[0]
         self.pop_sum = np.sum(self.pop, axis=1)
 
+        # new engine for the confirmed input, weights are kept for the same geometry
+        if self.engine is not None:
+            self.engine.close()
+        self.engine = SegregEngine(self.location, self.pop, **self.engineOptions())
+        self.logInput(layerName, time.perf_counter() - start)
+        self.locality = []
+        self.local_dissimilarity = []
+        self.local_exposure = []
+        self.local_entropy = []
+        self.local_indexh = []
+
+        # follow edits of the group values if live update is enabled
+        self.disconnectLiveUpdate()
+        if self.live_update is True:
+            selectedLayer.attributeValueChanged.connect(self.liveAttributeChanged)
+            self.liveLayer = selectedLayer
+
         # unlock measures tab and display confirmation if success
         if self.attributeMatrix is not None:
             self.dlg.tabWidget.setTabEnabled(1, True)
             self.iface.messageBar().pushMessage("Info",
              "Input saved", level=Qgis.Info, duration=2)
 
+    def disconnectLiveUpdate(self):
+        """Stop following edits of the confirmed layer"""
+        if self.liveLayer is not None:
+            try:
+                self.liveLayer.attributeValueChanged.disconnect(self.liveAttributeChanged)
+            except (TypeError, RuntimeError):
+                pass
+            self.liveLayer = None
+
+    def liveAttributeChanged(self, fid, idx, value):
+        """
+        Slot for attributeValueChanged of the confirmed layer, patches the
+        intensity and the measures computed when a group value is edited.
+        Edits made while a task is running are applied when it finishes.
+        """
+        if idx not in self.groupFields or fid not in self.featureRows:
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = 0.0
+        row = self.featureRows[fid]
+        self.pendingChanges.setdefault(row, {})[self.groupFields[idx]] = value
+        if self.task is None:
+            self.applyPendingChanges()
+
+    def applyPendingChanges(self):
+        """Update population with the live edits received so far"""
+        changes, self.pendingChanges = self.pendingChanges, {}
+        if changes and self.engine is not None:
+            self.updatePopulation(changes)
+
+    def updatePopulation(self, changes):
+        """
+        Change the population of a few tracts and update intensity and the
+        measures computed without recomputing them from scratch.
+        :param changes: dict of {row: {group column: value}}
+        """
+        rows = sorted(changes)
+        values = np.array(self.engine.pop[rows])
+        for i, row in enumerate(rows):
+            for col, value in changes[row].items():
+                values[i, col] = value
+        self.engine.updatePopulation(rows, values)
+
+        # keep plugin copies in sync with the engine
+        self.pop[rows] = self.engine.pop[rows]
+        self.pop_sum = np.sum(self.pop, axis=1)
+        if self.engine.locality is not None:
+            self.locality = self.engine.locality
+        self.syncMeasures()
+
     def runIntensityButton(self):
         """Run population intensity for selected bandwidth and weight method"""
         if not np.any(self.pop):
@@ -369,19 +496,115 @@ class Segreg(object):
             self.dlg.bgWeight.setId(self.dlg.bisquar, 2)
             self.dlg.bgWeight.setId(self.dlg.mvwind, 3)
 
-            # set parameters to call locality matrix
+            # set parameters to call locality matrix, a comma separated list runs a sweep
             weight = self.dlg.bgWeight.checkedId()
-            bw = int(self.dlg.leBandwidht.text())
+            bws = [int(x) for x in self.dlg.leBandwidht.text().replace(';', ',').split(',') if x.strip()]
+            bw = bws[0]
 
-            # check if weight method was selected
+            # check if weight method was selected, both run as background tasks
+            # on the engine of the confirmed input
+            engine = self.engine
             if weight == -1:
                 QMessageBox.critical(None, "Error", "Please select a weight method")
+            elif len(bws) > 1:
+                def sweep(progress):
+                    return engine.sweep(bws, [weight], self.keep_sweep_locality, progress)
+                self.startTask("Segreg bandwidth sweep",
+                               self.timed('sweep', sweep, bandwidths=bws, kernel=weight),
+                               lambda result: self.sweepFinished(result, len(bws)))
             else:
-                self.cal_localityMatrix(bw, weight)
-                self.iface.messageBar().pushMessage("Info",
-                 "Matrix of shape %s computed" % str(self.locality.shape),
-                                                level=Qgis.Info,
-                                                duration=4)
+                def intensity(progress):
+                    return engine.cal_localityMatrix(bw, weight, progress=progress)
+                self.startTask("Segreg population intensity",
+                               self.timed('intensity', intensity, bandwidth=bw, kernel=weight),
+                               lambda result: self.intensityFinished())
+
+    def intensityFinished(self):
+        """Take the intensity computed by the background task"""
+        self.syncIntensity()
+        self.showRunLog()
+        message = "Matrix of shape %s computed" % str(self.locality.shape)
+        if self.truncationError is not None:
+            message += ", truncated gaussian max error %.3g (relative %.3g)" % (
+                self.truncationError['max_abs_error'],
+                self.truncationError['max_rel_error'])
+        self.iface.messageBar().pushMessage("Info", message,
+                                        level=Qgis.Info,
+                                        duration=4)
+
+    def sweepFinished(self, result, n_bandwidths):
+        """Take the sweep computed by the background task"""
+        self.sweepResults, self.sweepLocality = result
+        self.measuresEmpty = False
+        self.showRunLog()
+        self.iface.messageBar().pushMessage("Info",
+         "Sweep of %s bandwidths computed" % str(n_bandwidths),
+                                        level=Qgis.Info,
+                                        duration=4)
+
+    def taskRunning(self):
+        """Warn and return True if a background task is running"""
+        if self.task is not None:
+            QMessageBox.information(None, "Warning", "Please wait for the running task to finish!")
+            return True
+        return False
+
+    def startTask(self, description, function, finished):
+        """
+        Run a stage as a cancellable background QgsTask, one at a time, on the
+        current engine. The engine is not replaced while the task runs.
+        :param description: task name shown on the QGIS task manager
+        :param function: callable receiving a progress callback, which reports the
+            done fraction and raises Cancelled when the task is cancelled
+        :param finished: callable receiving the result of function, called on the
+            main thread only if the stage completes and the engine is still current
+        """
+        if self.taskRunning():
+            return
+        engine = self.engine
+
+        def run(task):
+            def progress(fraction):
+                if task.isCanceled():
+                    raise Cancelled()
+                task.setProgress(100.0 * fraction)
+            # wrapped so an empty result is still handed back
+            return (function(progress),)
+
+        def done(exception, result=None):
+            task, self.task = self.task, None
+            if engine is not self.engine:
+                # dialog closed while running, results of the released engine are dropped
+                if engine is not None:
+                    engine.close()
+                return
+            if exception is None:
+                finished(result[0])
+            elif isinstance(exception, Cancelled) or task.isCanceled():
+                self.showRunLog()
+                self.iface.messageBar().pushMessage("Info", "%s cancelled" % description,
+                                                    level=Qgis.Info, duration=4)
+            else:
+                self.showRunLog()
+                QMessageBox.critical(None, "Error", "%s failed: %s" % (description, exception))
+            self.applyPendingChanges()
+
+        self.task = QgsTask.fromFunction(description, run, on_finished=done)
+        QgsApplication.taskManager().addTask(self.task)
+
+    def engineOptions(self):
+        """Keyword arguments to create the engine from the plugin settings"""
+        cache_dir = self.cache_dir
+        if cache_dir == '':
+            cache_dir = os.path.join(QgsApplication.qgisSettingsDirPath(), 'segreg_cache')
+        return dict(block_size=self.block_size, spatial_index=self.spatial_index,
+                    workers=self.workers,
+                    reuse_weights=self.reuse_weights, weight_sidecar=self.weightSidecar,
+                    weight_matrix=self.weightMatrix, out_of_core=self.out_of_core,
+                    memory_budget=self.memory_budget, scratch_dir=self.scratch_dir,
+                    gauss_tolerance=self.gauss_tolerance, dtype=self.dtype,
+                    exposure_pairs=self.exposure_pairs, cache_dir=cache_dir,
+                    cache_size=self.cache_size, column_cache=self.columnCache)
 
     def getWeight(self, distance, bandwidth, weightmethod=1):
         """
@@ -392,122 +615,90 @@ class Segreg(object):
         :return: weight value for internal use
         """
         distance = np.asarray(distance.T)
+        return kernel_weights(distance, bandwidth, weightmethod)
 
-        if weightmethod == 1:
-            weight = np.exp((-0.5) * (distance / bandwidth) * (distance / bandwidth))
-
-        elif weightmethod == 2:
-            weight = (1 - (distance / bandwidth) * (distance / bandwidth)) * (
-            1 - (distance / bandwidth) * (distance / bandwidth))
-            sel = np.where(distance > bandwidth)
-            weight[sel[0]] = 0
-
-        elif weightmethod == 3:
-            weight = (1 + (distance * 0))
-            sel = np.where(distance > bandwidth)
-            weight[sel[0]] = 0
-
-        else:
-            raise Exception('Invalid weight method selected!')
-
-        return weight
-
-    def cal_localityMatrix(self, bandwidth, weightmethod):
+    def cal_localityMatrix(self, bandwidth, weightmethod, block_size=None, spatial_index=None,
+                           workers=None):
         """
         Compute the local population intensity for all groups.
         :param bandwidth: bandwidth for neighborhood in meters
         :param weightmethod: 1 for gaussian, 2 for bi-square and empty for moving window
+        :param block_size: tracts computed at once, defaults to self.block_size
+        :param spatial_index: use KD-tree neighbors for bi-square and moving window,
+            defaults to self.spatial_index
+        :param workers: parallel workers over row chunks, defaults to self.workers
         :return: 2d array like with population intensity for all groups
         """
-        n_local = self.location.shape[0]
-        n_subgroup = self.pop.shape[1]
-        locality_temp = np.empty([n_local, n_subgroup])
-
-        for index in range(0, n_local):
-            for index_sub in range(0, n_subgroup):
-                cost = cdist(self.location[index, :], self.location)
-                weight = self.getWeight(cost, bandwidth, weightmethod)
-                locality_temp[index, index_sub] = np.sum(weight * np.asarray(self.pop[:, index_sub]))/np.sum(weight)
-
-        self.locality = locality_temp
-        # assign zero to negative values
-        self.locality[np.where(self.locality < 0)[0], np.where(self.locality < 0)[1]] = 0
+        if block_size is None:
+            block_size = self.block_size
+        if spatial_index is None:
+            spatial_index = self.spatial_index
+        if workers is None:
+            workers = self.workers
+
+        # workers are threads, processes are only used by headless runs (see batch.py)
+        self.engine.cal_localityMatrix(bandwidth, weightmethod, block_size, spatial_index, workers,
+                                       'thread')
+        self.syncIntensity()
+
+    def timed(self, name, function, **info):
+        """Wrap a task function to record its wall time on the run log"""
+        def run(progress):
+            with self.runLog.stage(name, **info):
+                return function(progress)
+        return run
+
+    def logInput(self, layer_name, seconds):
+        """Start the run log of a confirmed input with its sizes and engine options"""
+        options = self.engineOptions()
+        options.pop('weight_matrix')
+        options.pop('column_cache')
+        options['dtype'] = np.dtype(options['dtype']).name
+        self.runLog = RunLog(layer=layer_name, n_tracts=self.n_location, n_groups=self.n_group,
+                             engine=options)
+        self.runLog.record('load', seconds, n_tracts=self.n_location, n_groups=self.n_group,
+                           point=self.tract_point)
+        self.showRunLog()
+
+    def showRunLog(self):
+        """Show the timing summary below the project information"""
+        self.dlg.plainTextEdit.setPlainText('%s\n\nTiming of the last run:\n%s' % (
+            self.infoText, self.runLog.summary()))
+
+    def syncIntensity(self):
+        """Copy the intensity computed by the engine"""
+        self.locality = self.engine.locality
+        self.weightMatrix = self.engine.weightMatrix
+        self.truncationError = self.engine.truncationError
 
     def cal_localDissimilarity(self):
         """
         Compute local dissimilarity for all groups.
         """
-        # non-spatial version loop, uses raw data
-        if len(self.locality) == 0:
-            lj = np.ravel(self.pop_sum)
-            tjm = np.asarray(self.pop) * 1.0 / lj[:, None]
-            tm = np.sum(self.pop, axis=0) * 1.0 / np.sum(self.pop)
-            index_i = np.sum(np.asarray(tm) * np.asarray(1 - tm))
-            pop_total = np.sum(self.pop)
-            local_diss = np.sum(1.0 * np.array(np.fabs(tjm - tm)) *
-                                np.asarray(self.pop_sum).ravel()[:, None] / (2 * pop_total * index_i), axis=1)
-
-        # spatial version loop, uses population intensity
-        else:
-            lj = np.asarray(np.sum(self.locality, axis=1))
-            tjm = self.locality * 1.0 / lj[:, None]
-            tm = np.sum(self.pop, axis=0) * 1.0 / np.sum(self.pop)
-            index_i = np.sum(np.asarray(tm) * np.asarray(1 - tm))
-            pop_total = np.sum(self.pop)
-            local_diss = np.sum(1.0 * np.array(np.fabs(tjm - tm)) *
-                                np.asarray(self.pop_sum).ravel()[:, None] / (2 * pop_total * index_i), axis=1)
-
-        # clear nan values and transpose matrix
-        local_diss = np.nan_to_num(local_diss)
-        local_diss = np.asmatrix(local_diss).transpose()
-        self.local_dissimilarity = local_diss
+        local_diss = self.engine.cal_localDissimilarity()
+        self.local_dissimilarity = np.asmatrix(local_diss)
 
     def cal_globalDissimilarity(self):
         """
         Compute global dissimilarity calling the local version and summing up.
         """
-        local_diss = self.local_dissimilarity
-        self.global_dissimilarity = np.sum(local_diss)
+        self.global_dissimilarity = self.engine.cal_globalDissimilarity()
 
     def cal_localExposure(self):
         """
         Compute the local exposure index of group m to group n.
         in situations where m=n, then the result is the isolation index.
         """
-        m = self.n_group
-        j = self.n_location
-        exposure_rs = np.zeros((j, (m * m)))
-
-        # non-spatial version loop, uses raw data
-        if len(self.locality) == 0:
-            local_expo = np.asarray(self.pop) * 1.0 / np.asarray(np.sum(self.pop, axis=0)).ravel()
-            locality_rate = np.asarray(self.pop) * 1.0 / np.asarray(np.sum(self.pop, axis=1)).ravel()[:, None]
-            for i in range(m):
-                exposure_rs[:, ((i * m) + 0):((i * m) + m)] = np.asarray(locality_rate) * \
-                                                              np.asarray(local_expo[:, i]).ravel()[:, None]
-        # spatial version loop, uses population intensity
-        else:
-            local_expo = np.asarray(self.pop) * 1.0 / np.asarray(np.sum(self.pop, axis=0)).ravel()
-            locality_rate = np.asarray(self.locality) * 1.0 / np.asarray(np.sum(self.locality, axis=1)).ravel()[:, None]
-            for i in range(m):
-                exposure_rs[:, ((i * m) + 0):((i * m) + m)] = np.asarray(locality_rate) * \
-                                                              np.asarray(local_expo[:, i]).ravel()[:, None]
-
-        # clear nan and inf values and convert to matrix
-        exposure_rs[np.isinf(exposure_rs)] = 0
-        exposure_rs[np.isnan(exposure_rs)] = 0
-        exposure_rs = np.asmatrix(exposure_rs)
-        self.local_exposure = exposure_rs
+        self.local_exposure = []
+        exposure_rs = self.engine.cal_localExposure()
+        self.local_exposure = np.asmatrix(exposure_rs)
 
     def cal_globalExposure(self):
         """
         Compute global exposure calling the local version and summing up.
         """
-        m = self.n_group
-        local_exp = self.local_exposure
-        global_exp = np.sum(local_exp, axis=0)
-        global_exp = global_exp.reshape((m, m))
-        self.global_exposure = global_exp
+        global_exp = self.engine.cal_globalExposure()
+        self.global_exposure = np.asmatrix(global_exp)
 
     def cal_localEntropy(self):
         """
@@ -516,40 +707,13 @@ class Segreg(object):
         intensity was previously computed, the spatial version will be returned,
         otherwise the non spatial version will be selected (raw data).
         """
-        # non-spatial version, uses raw data
-        if len(self.locality) == 0:
-            proportion = np.asarray(self.pop / self.pop_sum)
-
-        # spatial version, uses population intensity
-        else:
-            polygon_sum = np.sum(self.locality, axis=1).reshape(self.n_location, 1)
-            proportion = np.asarray(self.locality / polygon_sum)
-
-        entropy = proportion * np.log(1 / proportion)
-
-        # clear nan and inf values, sum line and reshape
-        entropy[np.isnan(entropy)] = 0
-        entropy[np.isinf(entropy)] = 0
-        entropy = np.sum(entropy, axis=1)
-        entropy = entropy.reshape((self.n_location, 1))
-        self.local_entropy = entropy
+        self.local_entropy = self.engine.cal_localEntropy()
 
     def cal_globalEntropy(self):
         """
         Compute the global entropy score E (diversity), metropolitan area's entropy score.
         """
-        group_score = []
-        pop_total = np.sum(self.pop_sum)
-        prop = np.asarray(np.sum(self.pop, axis=0))[0]
-
-        # loop at sum of each population groups
-        for group in prop:
-            group_idx = group / pop_total * np.log(1 / (group / pop_total))
-            group_score.append(group_idx)
-
-        # sum scores from each group to get the result
-        global_entro = np.sum(group_score)
-        self.global_entropy = global_entro
+        self.global_entropy = self.engine.cal_globalEntropy()
 
     def cal_localIndexH(self):
         """
@@ -559,23 +723,24 @@ class Segreg(object):
         computed, the spatial version will be returned, else the non spatial
         version will be selected (raw data).
         """
-        local_entropy = self.local_entropy
-        global_entropy = self.global_entropy
-
-        # compute index
-        et = np.asarray(global_entropy * np.sum(self.pop_sum))
-        eei = np.asarray(global_entropy - local_entropy)
-        h_local = np.asarray(self.pop_sum) * eei / et
-
-        self.local_indexh = h_local
+        self.local_indexh = self.engine.cal_localIndexH()
 
     def cal_globalIndexH(self):
         """
         Compute global index H calling the local version summing up.
         """
-        h_local = self.local_indexh
-        h_global = np.sum(h_local)
-        self.global_indexh = h_global
+        self.global_indexh = self.engine.cal_globalIndexH()
+
+    def syncMeasures(self):
+        """Copy the measures computed by the engine, empty if missing or stale"""
+        for name in ALL_MEASURES:
+            value = []
+            if self.engine.isFresh(name):
+                value = getattr(self.engine, MEASURE_ATTRIBUTES[name])
+                # exposure and local dissimilarity are kept as matrix
+                if name in ('diss_local', 'expo_local', 'expo_global'):
+                    value = np.asmatrix(value)
+            setattr(self, MEASURE_ATTRIBUTES[name], value)
 
     def selectAllMeasures(self):
         """Select all check boxes on measures groups"""
@@ -587,142 +752,94 @@ class Segreg(object):
 
     def runMeasuresButton(self):
         """
-        Call the functions to compute local and global measures. The dependency
-        complexity is handle by chacking the flaged measures and calling local
-        measures for global versions. Results are stored for posterior output save.
+        Call the functions to compute local and global measures. The engine
+        schedules the checked measures and their inputs on the measure DAG and
+        only runs the ones missing or computed on a previous intensity.
+        Results are stored for posterior output save.
         """
-        all_measures = [self.dlg.expo_local,self.dlg.expo_global,
-                        self.dlg.diss_local, self.dlg.diss_global,
-                        self.dlg.entro_local, self.dlg.entro_global,
-                        self.dlg.idxh_local, self.dlg.idxh_global]
-        check_selected = [m.isChecked() for m in all_measures]
+        selected = [name for name in ALL_MEASURES if getattr(self.dlg, name).isChecked()]
 
         # check if there is at least one measure selected
-        if True not in check_selected:
+        if len(selected) == 0:
             QMessageBox.critical(None, "Error", "Please select measures!")
             return
         else:
-            # call local and global exposure/isolation measures
-            if self.dlg.expo_global.isChecked() is True:
-                self.cal_localExposure()
-                self.cal_globalExposure()
-            if self.dlg.expo_local.isChecked() is True and len(self.local_exposure) == 0:
-                self.cal_localExposure()
-
-            # call local and global dissimilarity measures
-            if self.dlg.diss_global.isChecked() is True:
-                self.cal_localDissimilarity()
-                self.cal_globalDissimilarity()
-            if self.dlg.diss_local.isChecked() is True and len(self.local_dissimilarity) == 0:
-                self.cal_localDissimilarity()
-
-            # call local and global entropy measures
-            if self.dlg.entro_global.isChecked() is True:
-                self.cal_localEntropy()
-                self.cal_globalEntropy()
-            if self.dlg.entro_local.isChecked() is True and len(self.local_entropy) == 0:
-                self.cal_localEntropy()
-
-            # call local and global index H measures
-            if self.dlg.idxh_global.isChecked() is True:
-                self.cal_localEntropy()
-                self.cal_globalEntropy()
-                self.cal_localIndexH()
-                self.cal_globalIndexH()
-            if self.dlg.idxh_local.isChecked() is True and len(self.local_indexh) == 0:
-                self.cal_localEntropy()
-                self.cal_globalEntropy()
-                self.cal_localIndexH()
-
-            # inform sucess if all were computed
-            QMessageBox.information(None, "Info", 'Measures computed successfully!')
-            self.measuresEmpty = False
-
-    def joinResultsData(self):
-        """ Join results on a unique matrix and assign names for columns to be
-        used as header for csv file and shapefile output"""
-        names = ['id','x','y']
-        measures_computed = []
-
-        # create new names for groups starting by 0
-        for i in range(self.n_group):
-            names.append('group_' + str(i))
-
-        # update names with locality if computed
-        if len(self.locality) != 0:
-            measures_computed.append(self.locality)
-            for i in range(self.n_group):
-                names.append('intens_' + str(i))
-
-        # update names with exposure/isolation if computed
-        if self.dlg.expo_local.isChecked() is True:
-            measures_computed.append(self.local_exposure)
-            for i in range(self.n_group):
-                for j in range(self.n_group):
-                    if i == j:
-                        names.append('iso_' + str(i) + str(j))
-                    else:
-                        names.append('exp_' + str(i) + str(j))
-
-        # update names with dissimilarity if computed
-        if self.dlg.diss_local.isChecked() is True:
-            measures_computed.append(self.local_dissimilarity)
-            names.append('dissimil')
-
-        # update names with entropy if computed
-        if self.dlg.entro_local.isChecked() is True:
-            measures_computed.append(self.local_entropy)
-            names.append('entropy')
-
-        # update names with index H if computed
-        if self.dlg.idxh_local.isChecked() is True:
-            measures_computed.append(self.local_indexh)
-            names.append('indexh')
-
-        # output_labels = tuple([eval(x) for x in measures_computed])
-        output_labels = measures_computed
-        # try to concaneta results, else only original input
-        try:
-            computed_results = np.concatenate(output_labels, axis=1)
-            results_matrix = np.concatenate((self.tract_id, self.attributeMatrix, computed_results), axis=1)
-            measures_computed[:] = []
-            return results_matrix, names
-        except ValueError:
-            results_matrix = np.concatenate((self.tract_id, self.attributeMatrix), axis=1)
-            return results_matrix, names
-        except:
-            QMessageBox.critical(None, "Error", 'Could not join result data!')
-            raise
+            # compute checked measures as a background task, local ones in a single pass.
+            # local exposure (n x m*m) is only materialized when results are exported
+            engine = self.engine
+
+            def compute(progress):
+                return engine.compute([n for n in selected if n != 'expo_local'], progress)
+            self.startTask("Segreg measures",
+                           self.timed('measures', compute, measures=selected),
+                           lambda result: self.measuresFinished())
+
+    def measuresFinished(self):
+        """Take the measures computed by the background task"""
+        self.syncMeasures()
+        self.showRunLog()
+
+        # inform sucess if all were computed
+        QMessageBox.information(None, "Info", 'Measures computed successfully!')
+        self.measuresEmpty = False
+
+    def joinResultsData(self, local_measures=None, engine=None):
+        """ Gather ids and typed result blocks and assign names for columns to be
+        used as header for csv file and shapefile output
+        :param local_measures: local measure names, the checked ones if None
+        :param engine: engine holding the results, self.engine if None
+        """
+        if local_measures is None:
+            local_measures = [name for name in LOCAL_MEASURES if getattr(self.dlg, name).isChecked()]
+        if engine is None:
+            engine = self.engine
+        names, blocks = engine.resultColumns(local_measures)
+        names = ['id'] + names
+
+        # blocks keep their dtype, rows must match the tract ids
+        if any(np.shape(b)[0] != len(self.tract_id) for b in blocks):
+            raise ValueError('Could not join result data!')
+        return self.tract_id, names, blocks
 
     def addShapeToCanvas(self, result, path):
         """Add results to Canvas as a new shapefile based on original input"""
         # get data from layer confirmed on groups selection
         sourceLayer = QgsProject.instance().mapLayersByName(self.confirmedLayerName)[0]
-        sourceFeats = [feat for feat in sourceLayer.getFeatures()]
         sourceGeometryType = ['Point','Line','Polygon'][sourceLayer.geometryType()]
         sourceCRS = sourceLayer.crs().authid()
 
-        # data from results for the new layer
+        # data from results for the new layer, rows are matched by feature id
         name = QFileInfo(path).baseName()
-        data = result[0][:, (3 + self.n_group):]
+        blocks = [np.asarray(b, dtype=float) for b in result[2][2:]]
+        data = np.concatenate(blocks, axis=1).tolist() if blocks else [[]] * len(result[0])
         labels = result[1][(3 + self.n_group):]
 
-        # create new layer copying data from source and extend fields
+        # create new layer copying fields from source and extend them with results
         newLayer = QgsVectorLayer(sourceGeometryType + '?crs='+sourceCRS, name, "memory")
         provider = newLayer.dataProvider()
         attr = sourceLayer.dataProvider().fields().toList()
+        sourceNames = [field.name() for field in attr]
         attr.extend([QgsField(label, QVariant.Double) for label in labels])
         provider.addAttributes(attr)
         newLayer.updateFields()
-        provider.addFeatures(sourceFeats)
 
-        # add results from measures selected for calculation
-        for idxfeat, feat in enumerate(newLayer.getFeatures()):
-            featid = int(feat.id())
-            for idxlabel, label in enumerate(labels):
-                idxfield = int(provider.fieldNameMap()[label])
-                val = float(data[idxfeat, idxlabel])
-                provider.changeAttributeValues({featid : {idxfield : val}})
+        # geometries and source attributes come from the layer snapshot
+        snapshot = self.snapshots.get(sourceLayer)
+        snapshot.read(sourceNames)
+        sourceValues = [snapshot.values[field] for field in sourceNames]
+
+        # build features with their full attribute vectors and add them at once
+        fields = newLayer.fields()
+        newFeats = []
+        for row, fid in enumerate(snapshot.fids.tolist()):
+            if fid not in self.featureRows:
+                continue
+            newFeat = QgsFeature(fields)
+            newFeat.setGeometry(snapshot.geometries[row])
+            newFeat.setAttributes([values[row] for values in sourceValues] +
+                                  data[self.featureRows[fid]])
+            newFeats.append(newFeat)
+        provider.addFeatures(newFeats)
 
         # add new layer to canvas
         QgsProject.instance().addMapLayer(newLayer)
@@ -736,35 +853,87 @@ class Segreg(object):
             filename, __ = QFileDialog.getSaveFileName(self.dlg, "Select output file ", "", "*.csv")
             self.dlg.leOutput.setText(filename)
             path = self.dlg.leOutput.text()
-            result = self.joinResultsData()
-            labels = str(', '.join(result[1]))
+            local_measures = [name for name in LOCAL_MEASURES if getattr(self.dlg, name).isChecked()]
+
+            # files are written by a background task, the local exposure deferred
+            # by runMeasuresButton is computed there first
+            engine = self.engine
+
+            def export(progress):
+                # join and export are timed as separate stages
+                with self.runLog.stage('join'):
+                    engine.compute([n for n in local_measures if n == 'expo_local'])
+                    result = self.joinResultsData(local_measures, engine)
+                with self.runLog.stage('export', rows=self.n_location):
+                    self.writeResults(path, result, progress, engine)
+                return result
+            self.startTask("Segreg export", export,
+                           lambda result: self.exportFinished(path, result))
+
+    def writeResults(self, path, result, progress=None, engine=None):
+        """
+        Write local results, global results and the sweep table to csv files.
+        :param path: output csv path for local results
+        :param result: tuple (ids, names, blocks) from joinResultsData()
+        :param progress: optional callable receiving the done fraction after each row block
+        :param engine: engine holding the results, self.engine if None
+        """
+        if engine is None:
+            engine = self.engine
+        ids, names, blocks = result
+
+        # save local measures results on a csv file, typed blocks are written by row chunks
+        write_local(path, ids, names[1:], blocks, self.float_format,
+                    header='# %s' % ', '.join(names), progress=progress)
+
+        # save every exposure pair in long format if requested
+        if self.exposure_long is True:
+            write_long("%s_exposure_long.csv" % path[:-4], ids, exposure_pairs(self.n_group),
+                       engine.exposureBlocks(), self.float_format)
+
+        # save global results to a second csv file
+        with open("%s_global.csv" % path[:-4], "w") as f:
+            f.write('Global dissimilarity: ' + str(self.global_dissimilarity))
+            f.write('\nGlobal entropy: ' + str(self.global_entropy))
+            f.write('\nGlobal Index H: ' + str(self.global_indexh))
+            f.write('\nGlobal isolation/exposure: \n')
+            f.write(str(self.global_exposure))
+
+        # save bandwidth sweep table if computed
+        if len(self.sweepResults) != 0:
+            save_sweep(self.sweepResults, self.n_group, "%s_sweep.csv" % path[:-4])
+
+    def exportFinished(self, path, result):
+        """Add the saved results to canvas and clear local results"""
+        # add result to canvas as shapefile if requested
+        if self.dlg.addToCanvas.isChecked() is True:
+            try:
+                with self.runLog.stage('add_to_canvas'):
+                    self.addShapeToCanvas(result, path)
+            except:
+                QMessageBox.critical(None, "Error", "Could not create shape!")
+                return
+            finally:
+                self.saveRunLog(path)
+        else:
+            self.saveRunLog(path)
 
-            # save local measures results on a csv file
-            np.savetxt(path, result[0], header=labels, delimiter=',', newline='\n', fmt="%s")
+        # clear local variables after save
+        self.local_dissimilarity = []
+        self.local_exposure = []
+        self.local_entropy = []
+        self.local_indexh = []
+        self.engine.clearLocalResults()
+        # inform success
+        QMessageBox.information(None, "Info", "Results saved successfully!")
 
-            # add result to canvas as shapefile if requested
-            if self.dlg.addToCanvas.isChecked() is True:
-                try:
-                    self.addShapeToCanvas(result, path)
-                except:
-                    QMessageBox.critical(None, "Error", "Could not create shape!")
-                    return
-
-            # save global results to a second csv file
-            with open("%s_global.csv" % path[:-4], "w") as f:
-                f.write('Global dissimilarity: ' + str(self.global_dissimilarity))
-                f.write('\nGlobal entropy: ' + str(self.global_entropy))
-                f.write('\nGlobal Index H: ' + str(self.global_indexh))
-                f.write('\nGlobal isolation/exposure: \n')
-                f.write(str(self.global_exposure))
-
-            # clear local variables after save
-            self.local_dissimilarity = []
-            self.local_exposure = []
-            self.local_entropy = []
-            self.local_indexh = []
-            # inform success
-            QMessageBox.information(None, "Info", "Results saved successfully!")
+    def saveRunLog(self, path):
+        """Save the run log as JSON next to the outputs and show its summary"""
+        try:
+            self.runLog.save("%s_runlog.json" % path[:-4])
+        except (IOError, OSError):
+            pass
+        self.showRunLog()
 
     def run(self):
         """Run method to call dialog and connect interface with functions"""
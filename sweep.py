@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Multi-bandwidth sweep: intensities and global measures for a list of
+ bandwidths and weight methods computing distances only once.
+"""
+from __future__ import absolute_import
+from builtins import range
+from builtins import str
+import csv
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial.distance import cdist
+
+from .intensity import DEFAULT_BLOCK_SIZE, kernel_weights, neighbor_distances, support_radius
+from . import measures
+
+
+def sweep_localities(location, pop, bandwidths, weightmethods=(1,), block_size=DEFAULT_BLOCK_SIZE,
+                     spatial_index=False, tolerance=None, progress=None):
+    """
+    Compute the population intensity for every weight method and bandwidth.
+    Distance blocks (or KD-tree neighbor lists for compact kernels and the
+    truncated gaussian when spatial_index is set) are computed once and
+    shared by all of them.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param pop: 2d array like with population of each group by tract
+    :param bandwidths: list of bandwidths in meters
+    :param weightmethods: list of weight methods, 1-gaussian, 2-bi square and 3-moving window
+    :param block_size: number of tracts computed at once on the dense path
+    :param spatial_index: use KD-tree neighbors for compact kernels
+    :param tolerance: relative tolerance to truncate the gaussian, None for the exact kernel
+    :param progress: optional callable receiving the done fraction, it may raise
+        intensity.Cancelled to stop the run
+    :return: dict of {(weightmethod, bandwidth): locality}
+    """
+    location = np.asarray(location, dtype=float)
+    pop = np.asarray(pop, dtype=float)
+    n_local = location.shape[0]
+    combos = [(wm, bw) for wm in weightmethods for bw in bandwidths]
+    radius = dict((c, support_radius(c[1], c[0], tolerance)) for c in combos)
+    sparse = [c for c in combos if spatial_index and radius[c] is not None]
+    dense = [c for c in combos if c not in sparse]
+    localities = dict((c, np.empty((n_local, pop.shape[1]))) for c in combos)
+
+    # dense path, one distance block shared by all combinations
+    if dense:
+        block_size = max(1, int(block_size))
+        for start in range(0, n_local, block_size):
+            stop = min(start + block_size, n_local)
+            distance = cdist(location[start:stop], location)
+            weight = np.empty_like(distance)
+            for c in dense:
+                kernel_weights(distance, c[1], c[0], out=weight, tolerance=tolerance)
+                locality = localities[c][start:stop]
+                np.dot(weight, pop, out=locality)
+                locality /= np.sum(weight, axis=1)[:, None]
+            if progress is not None:
+                progress(stop * len(dense) * 1.0 / (n_local * len(combos)))
+
+    # sparse path, neighbor lists searched once at the largest kernel support
+    if sparse:
+        distance, indices, indptr = neighbor_distances(location, max(radius[c] for c in sparse))
+        weight = np.empty_like(distance)
+        for c in sparse:
+            kernel_weights(distance, c[1], c[0], out=weight, tolerance=tolerance)
+            matrix = csr_matrix((weight, indices, indptr), shape=(n_local, n_local))
+            locality = localities[c]
+            locality[...] = matrix.dot(pop)
+            locality /= np.asarray(matrix.sum(axis=1))
+            if progress is not None:
+                progress((len(dense) + sparse.index(c) + 1) * 1.0 / len(combos))
+
+    # assign zero to negative values
+    for locality in localities.values():
+        locality[locality < 0] = 0
+    return localities
+
+
+def bandwidth_sweep(location, pop, bandwidths, weightmethods=(1,), block_size=DEFAULT_BLOCK_SIZE,
+                    spatial_index=False, keep_locality=False, tolerance=None, progress=None):
+    """
+    Compute global dissimilarity, exposure, entropy and index H for every
+    weight method and bandwidth.
+    :param location: 2d array like with x and y coordinates of each tract
+    :param pop: 2d array like with population of each group by tract
+    :param bandwidths: list of bandwidths in meters
+    :param weightmethods: list of weight methods, 1-gaussian, 2-bi square and 3-moving window
+    :param block_size: number of tracts computed at once on the dense path
+    :param spatial_index: use KD-tree neighbors for compact kernels
+    :param keep_locality: also return the per-tract intensity of each combination
+    :param tolerance: relative tolerance to truncate the gaussian, None for the exact kernel
+    :param progress: optional callable receiving the done fraction of the intensities,
+        it may raise intensity.Cancelled to stop the run
+    :return: tuple (rows, localities), rows is a list of dicts one per weight
+        method and bandwidth, localities a dict of {(weightmethod, bandwidth): locality}
+        or None if keep_locality is False
+    """
+    pop = np.asarray(pop, dtype=float)
+    localities = sweep_localities(location, pop, bandwidths, weightmethods, block_size, spatial_index,
+                                  tolerance, progress)
+    global_entro = measures.global_entropy(pop)
+
+    rows = []
+    for wm in weightmethods:
+        for bw in bandwidths:
+            local = measures.fused_local_measures(pop, localities[(wm, bw)],
+                                                  ('dissimilarity', 'indexh'), block_size)
+            global_exp = measures.global_exposure_direct(pop, localities[(wm, bw)], block_size)
+
+            rows.append(global_row(wm, bw, measures.global_dissimilarity(local['dissimilarity']),
+                                   global_exp, global_entro,
+                                   measures.global_indexh(local['indexh'])))
+
+    if not keep_locality:
+        localities = None
+    return rows, localities
+
+
+def global_row(weightmethod, bandwidth, dissimil, exposure, entropy, indexh):
+    """
+    Build one line of the global table, measures not computed may be None.
+    :param exposure: m x m global exposure/isolation array
+    :return: dict keyed by the names of sweep_columns()
+    """
+    row = dict(weightmethod=weightmethod, bandwidth=bandwidth, dissimil=dissimil,
+               entropy=entropy, indexh=indexh)
+    if exposure is not None:
+        exposure = np.asarray(exposure)
+        for i in range(exposure.shape[0]):
+            for j in range(exposure.shape[1]):
+                prefix = 'iso_' if i == j else 'exp_'
+                row[prefix + str(i) + str(j)] = exposure[i, j]
+    return row
+
+
+def sweep_columns(n_group):
+    """Column names of the sweep table in output order"""
+    names = ['weightmethod', 'bandwidth', 'dissimil', 'entropy', 'indexh']
+    for i in range(n_group):
+        for j in range(n_group):
+            prefix = 'iso_' if i == j else 'exp_'
+            names.append(prefix + str(i) + str(j))
+    return names
+
+
+def save_sweep(rows, n_group, path):
+    """
+    Save the sweep table to a csv file, one line per weight method and bandwidth.
+    :param rows: list of dicts returned by bandwidth_sweep()
+    :param n_group: number of groups
+    :param path: output csv path
+    """
+    names = sweep_columns(n_group)
+    with open(path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=names, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
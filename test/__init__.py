@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Tests of the Segreg engine, run with nosetests (see the Makefile test target)"""
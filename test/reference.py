@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Reference implementations the faster paths are checked against, written as
+the tract by tract loops and measure formulas of the original plugin.
+"""
+from __future__ import absolute_import
+from builtins import range
+import numpy as np
+from scipy.spatial.distance import cdist
+
+
+def random_layer(n_tracts=150, n_groups=3, seed=0):
+    """
+    Small random layer with clustered groups and one empty tract.
+    :return: tuple (location, pop) with n x 2 and n x m arrays
+    """
+    rng = np.random.RandomState(seed)
+    location = rng.uniform(0, 5000, (n_tracts, 2))
+    share = rng.dirichlet(np.ones(n_groups), n_tracts)
+    share[location[:, 0] > 2500, 0] += 1.0
+    pop = rng.poisson(200 * share).astype(float)
+    pop[0] = 0
+    return location, pop
+
+
+def weight(distance, bandwidth, weightmethod):
+    """Kernel weights as computed by the original getWeight()"""
+    if weightmethod == 1:
+        return np.exp((-0.5) * (distance / bandwidth) * (distance / bandwidth))
+    elif weightmethod == 2:
+        result = (1 - (distance / bandwidth) * (distance / bandwidth)) * (
+            1 - (distance / bandwidth) * (distance / bandwidth))
+    else:
+        result = 1 + (distance * 0)
+    result[distance > bandwidth] = 0
+    return result
+
+
+def locality(location, pop, bandwidth, weightmethod):
+    """Population intensity computed tract by tract and group by group"""
+    n_local, n_group = pop.shape
+    result = np.empty((n_local, n_group))
+    for index in range(n_local):
+        for group in range(n_group):
+            w = weight(cdist(location[index:index + 1], location)[0], bandwidth, weightmethod)
+            result[index, group] = np.sum(w * pop[:, group]) / np.sum(w)
+    result[result < 0] = 0
+    return result
+
+
+def measures(pop, local=None):
+    """
+    Local and global measures of the original plugin, spatial if the
+    intensity is given, otherwise non spatial.
+    :return: dict with the engine measure names
+    """
+    pop = np.asarray(pop, dtype=float)
+    data = pop if local is None else np.asarray(local, dtype=float)
+    n_local, m = pop.shape
+    pop_sum = pop.sum(axis=1)
+    result = {}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tjm = data / data.sum(axis=1)[:, None]
+        tm = pop.sum(axis=0) / pop.sum()
+        index_i = np.sum(tm * (1 - tm))
+        diss = np.nan_to_num(np.sum(np.fabs(tjm - tm) * pop_sum[:, None] /
+                                    (2 * pop.sum() * index_i), axis=1))
+        result['diss_local'] = diss.reshape((-1, 1))
+        result['diss_global'] = np.sum(diss)
+
+        exposure = np.zeros((n_local, m * m))
+        local_expo = pop / pop.sum(axis=0)
+        for i in range(m):
+            exposure[:, i * m:i * m + m] = tjm * local_expo[:, i][:, None]
+        exposure[~np.isfinite(exposure)] = 0
+        result['expo_local'] = exposure
+        result['expo_global'] = exposure.sum(axis=0).reshape((m, m))
+
+        entropy = tjm * np.log(1 / tjm)
+        entropy[~np.isfinite(entropy)] = 0
+        entropy = entropy.sum(axis=1).reshape((-1, 1))
+        result['entro_local'] = entropy
+        prop = pop.sum(axis=0) / pop_sum.sum()
+        result['entro_global'] = np.sum(prop * np.log(1 / prop))
+
+    e = result['entro_global']
+    indexh = pop_sum[:, None] * (e - entropy) / (e * pop_sum.sum())
+    result['idxh_local'] = indexh
+    result['idxh_global'] = np.sum(indexh)
+    return result
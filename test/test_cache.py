@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Result and column caches, and engine runs served from them"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from .. import engine as engine_module
+from ..cache import ColumnCache, ResultCache, cache_key
+from ..engine import ALL_MEASURES, MEASURE_ATTRIBUTES, UNCACHED_MEASURES, SegregEngine
+from ..intensity import locality_matrix
+from . import reference
+
+BANDWIDTH = 900
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='segreg_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def engine(self, pop=None, **options):
+        return SegregEngine(self.location, self.pop if pop is None else pop,
+                            cache_dir=self.path, **options)
+
+    def test_hit_and_miss(self):
+        cache = ResultCache(self.path)
+        key = cache_key('locality', self.pop, BANDWIDTH)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, locality=self.pop, weight_sum=np.arange(3.0))
+        entry = cache.get(key)
+        np.testing.assert_array_equal(entry['locality'], self.pop)
+        np.testing.assert_array_equal(entry['weight_sum'], np.arange(3.0))
+        self.assertIsNone(cache.get(cache_key('locality', self.pop, BANDWIDTH + 1)))
+
+        # unreadable entries are a miss
+        with open(cache.entry_path(key), 'wb') as f:
+            f.write(b'not a npz file')
+        self.assertIsNone(cache.get(key))
+
+    def test_key(self):
+        key = cache_key('locality', self.pop, BANDWIDTH, 1, None)
+        self.assertEqual(key, cache_key('locality', self.pop.copy(), BANDWIDTH, 1, None))
+        pop = self.pop.copy()
+        pop[5, 1] += 1
+        for other in (cache_key('locality', pop, BANDWIDTH, 1, None),
+                      cache_key('locality', self.pop.astype(np.float32), BANDWIDTH, 1, None),
+                      cache_key('locality', self.pop.T, BANDWIDTH, 1, None),
+                      cache_key('locality', self.pop, BANDWIDTH + 1, 1, None),
+                      cache_key('locality', self.pop, BANDWIDTH, 2, None),
+                      cache_key('locality', self.pop, BANDWIDTH, 1, 1e-4)):
+            self.assertNotEqual(key, other)
+
+    def test_lru_eviction_by_mtime(self):
+        value = np.zeros(1000)
+        cache = ResultCache(self.path)
+        for i, key in enumerate('abc'):
+            cache.put(key, value=value)
+            os.utime(cache.entry_path(key), (1000 + i, 1000 + i))
+        size = os.path.getsize(cache.entry_path('a'))
+
+        # reading an entry marks it as recently used
+        cache.get('a')
+        cache.max_bytes = 3 * size
+        cache.put('d', value=value)
+        self.assertEqual(sorted(os.path.basename(path) for _, _, path in cache.entries()),
+                         ['a.npz', 'c.npz', 'd.npz'])
+        self.assertLessEqual(cache.size(), cache.max_bytes)
+
+        # an entry over the limit does not stay
+        cache.max_bytes = size // 2
+        cache.put('e', value=value)
+        self.assertEqual(cache.entries(), [])
+
+    def test_engine_served_from_cache(self):
+        self.engine().run(ALL_MEASURES, BANDWIDTH, 1)
+        failure = AssertionError('intensity computed on a cache hit')
+        engine = self.engine()
+        with mock.patch.object(engine_module, 'locality_matrix', side_effect=failure), \
+                mock.patch.object(engine, 'cal_localMeasures',
+                                  wraps=engine.cal_localMeasures) as local:
+            result = engine.run(ALL_MEASURES, BANDWIDTH, 1)
+        # only the measures left out of the cache are computed
+        self.assertEqual(local.call_args[0][0], list(UNCACHED_MEASURES))
+        expected = reference.measures(self.pop, reference.locality(self.location, self.pop,
+                                                                   BANDWIDTH, 1))
+        for name in ALL_MEASURES:
+            np.testing.assert_allclose(
+                np.asarray(getattr(result, MEASURE_ATTRIBUTES[name]), dtype=float).reshape(
+                    np.shape(expected[name])), expected[name], rtol=1e-10, atol=1e-12,
+                err_msg=name)
+
+    def test_uncached_measures_not_stored(self):
+        engine = self.engine()
+        engine.run(ALL_MEASURES, BANDWIDTH, 1)
+        # the intensity and every measure but the local exposure
+        self.assertEqual(len(engine.cache.entries()), 1 + len(ALL_MEASURES) - 1)
+        self.assertEqual(UNCACHED_MEASURES, ('expo_local',))
+        self.assertFalse(os.path.exists(engine.cache.entry_path(engine.cacheKey('expo_local'))))
+        self.assertFalse(engine.loadCached('expo_local'))
+
+    def test_key_invalidation(self):
+        pop = self.pop.copy()
+        pop[7] = [10, 0, 5]
+        runs = [(dict(pop=pop), BANDWIDTH, 1), (dict(), BANDWIDTH + 300, 1),
+                (dict(), BANDWIDTH, 2), (dict(gauss_tolerance=1e-4), BANDWIDTH, 1)]
+        self.engine().run(ALL_MEASURES, BANDWIDTH, 1)
+        for options, bandwidth, weightmethod in runs:
+            engine = self.engine(**options)
+            with mock.patch.object(engine_module, 'locality_matrix',
+                                   wraps=engine_module.locality_matrix) as compute:
+                engine.run(['diss_global'], bandwidth, weightmethod)
+            self.assertEqual(compute.call_count, 1)
+            expected = reference.locality(self.location, engine.pop, bandwidth, weightmethod)
+            if 'gauss_tolerance' in options:
+                np.testing.assert_allclose(engine.locality, expected, rtol=1e-3, atol=1e-2)
+            else:
+                np.testing.assert_allclose(engine.locality, expected, rtol=1e-12, atol=1e-10)
+                self.assertAlmostEqual(engine.global_dissimilarity, reference.measures(
+                    engine.pop, expected)['diss_global'], delta=1e-12)
+
+        # the tolerance is not part of the key of the compact kernels
+        engine = self.engine(gauss_tolerance=1e-4)
+        with mock.patch.object(engine_module, 'locality_matrix', side_effect=AssertionError):
+            engine.run(['diss_global'], BANDWIDTH, 2)
+
+
+class ColumnCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+
+    def test_lru_at_capacity(self):
+        value = np.zeros(10)
+        cache = ColumnCache(3 * value.nbytes)
+        for key in 'abc':
+            cache.put(key, value.copy())
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('d', value.copy())
+        self.assertEqual(list(cache.items), ['c', 'a', 'd'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.nbytes, 3 * value.nbytes)
+
+        # replacing an item keeps the size right, larger items are not kept
+        cache.put('c', np.zeros(5))
+        self.assertEqual(cache.nbytes, 2 * value.nbytes + 5 * 8)
+        cache.put('e', np.zeros(40))
+        self.assertIsNone(cache.get('e'))
+        self.assertEqual(list(cache.items), ['a', 'd', 'c'])
+        cache.clear()
+        self.assertEqual((len(cache.items), cache.nbytes), (0, 0))
+
+    def fresh(self, pop, weightmethod):
+        return locality_matrix(self.location, pop, BANDWIDTH, weightmethod)
+
+    def test_partial_hit(self):
+        pop = self.pop.copy()
+        pop[:, 1] = pop[::-1, 1]
+        for weightmethod in (1, 3):
+            columns = ColumnCache()
+            SegregEngine(self.location, self.pop, column_cache=columns).cal_localityMatrix(
+                BANDWIDTH, weightmethod)
+            engine = SegregEngine(self.location, pop, column_cache=columns)
+            with mock.patch.object(engine_module, 'locality_matrix',
+                                   wraps=engine_module.locality_matrix) as compute:
+                locality = engine.cal_localityMatrix(BANDWIDTH, weightmethod)
+            # only the changed group is computed
+            np.testing.assert_array_equal(compute.call_args[0][1], pop[:, [1]])
+            np.testing.assert_allclose(locality, self.fresh(pop, weightmethod), rtol=1e-12,
+                                       atol=1e-10)
+
+    def test_subset_hit(self):
+        columns = ColumnCache()
+        SegregEngine(self.location, self.pop, column_cache=columns).cal_localityMatrix(
+            BANDWIDTH, 2)
+        pop = self.pop[:, [2, 0]]
+        engine = SegregEngine(self.location, pop, column_cache=columns)
+        with mock.patch.object(engine_module, 'locality_matrix', side_effect=AssertionError):
+            locality = engine.cal_localityMatrix(BANDWIDTH, 2)
+        np.testing.assert_allclose(locality, self.fresh(pop, 2), rtol=1e-12, atol=1e-10)
+        weight_sum = np.empty(len(pop))
+        locality_matrix(self.location, pop, BANDWIDTH, 2, weight_sum=weight_sum)
+        np.testing.assert_allclose(engine.weightSum, weight_sum, rtol=1e-12)
+
+        # other bandwidths and kernels miss
+        for bandwidth, weightmethod in ((BANDWIDTH + 1, 2), (BANDWIDTH, 3)):
+            with mock.patch.object(engine_module, 'locality_matrix',
+                                   wraps=engine_module.locality_matrix) as compute:
+                engine.cal_localityMatrix(bandwidth, weightmethod)
+            self.assertEqual(compute.call_count, 1)
+
+    def test_weights_shared(self):
+        columns = ColumnCache()
+        first = SegregEngine(self.location, self.pop, reuse_weights=True, column_cache=columns)
+        first.cal_localityMatrix(BANDWIDTH, 2)
+        engine = SegregEngine(self.location, self.pop[:, :2] + 1, reuse_weights=True,
+                              column_cache=columns)
+        locality = engine.cal_localityMatrix(BANDWIDTH, 2)
+        self.assertIs(engine.weightMatrix, first.weightMatrix)
+        np.testing.assert_allclose(locality, self.fresh(self.pop[:, :2] + 1, 2), rtol=1e-12,
+                                   atol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Headless engine runs against the original loop and formulas"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..engine import ALL_MEASURES, MEASURE_ATTRIBUTES, SegregEngine
+from . import reference
+
+BANDWIDTH = 900
+KERNELS = (1, 2, 3)
+
+
+class EngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+
+    def assertResult(self, result, expected):
+        for name in ALL_MEASURES:
+            np.testing.assert_allclose(
+                np.asarray(getattr(result, MEASURE_ATTRIBUTES[name]), dtype=float).reshape(
+                    np.shape(expected[name])), expected[name], rtol=1e-10, atol=1e-12,
+                err_msg=name)
+
+    def test_engine_matches_reference(self):
+        for weightmethod in KERNELS:
+            locality = reference.locality(self.location, self.pop, BANDWIDTH, weightmethod)
+            expected = reference.measures(self.pop, locality)
+            for options in (dict(), dict(block_size=7, workers=2)):
+                engine = SegregEngine(self.location, self.pop, **options)
+                try:
+                    result = engine.run(ALL_MEASURES, BANDWIDTH, weightmethod)
+                    self.assertEqual((result.bandwidth, result.weightmethod),
+                                     (BANDWIDTH, weightmethod))
+                    np.testing.assert_allclose(result.locality, locality, rtol=1e-12,
+                                               atol=1e-10)
+                    self.assertResult(result, expected)
+                finally:
+                    engine.close()
+
+    def test_engine_non_spatial(self):
+        engine = SegregEngine(self.location, self.pop)
+        engine.run(ALL_MEASURES, BANDWIDTH, 1)
+        result = engine.run(ALL_MEASURES)
+        self.assertIsNone(result.locality)
+        self.assertIsNone(result.bandwidth)
+        self.assertResult(result, reference.measures(self.pop))
+
+    def test_result_columns(self):
+        engine = SegregEngine(self.location, self.pop)
+        engine.run(['diss_local', 'entro_local'], BANDWIDTH, 2)
+        names, blocks = engine.resultColumns()
+        self.assertEqual(names, ['x', 'y', 'group_0', 'group_1', 'group_2', 'intens_0',
+                                 'intens_1', 'intens_2', 'dissimil', 'entropy'])
+        self.assertEqual(sum(block.shape[1] for block in blocks), len(names))
+
+    def test_invalid_measure(self):
+        engine = SegregEngine(self.location, self.pop)
+        with self.assertRaises(ValueError):
+            engine.run(['diss_local', 'gini'], BANDWIDTH, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Selected exposure pairs and the direct global exposure against the original formulas"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..engine import SegregEngine
+from .. import measures
+from . import reference
+
+BANDWIDTH = 900
+
+
+class ExposureTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.locality = reference.locality(cls.location, cls.pop, BANDWIDTH, 1)
+
+    def test_direct_global_matches_reference(self):
+        for locality in (None, self.locality):
+            expected = reference.measures(self.pop, locality)['expo_global']
+            for block_size in (None, 1, 9):
+                result = measures.global_exposure_direct(self.pop, locality, block_size)
+                np.testing.assert_allclose(result, expected, rtol=1e-10, atol=1e-12)
+
+    def test_engine_global_without_local(self):
+        engine = SegregEngine(self.location, self.pop)
+        engine.cal_localityMatrix(BANDWIDTH, 1)
+        self.assertEqual(engine.compute(['expo_global']), ['expo_global'])
+        self.assertIsNone(engine.local_exposure)
+        np.testing.assert_allclose(engine.global_exposure,
+                                   reference.measures(self.pop, self.locality)['expo_global'],
+                                   rtol=1e-10, atol=1e-12)
+
+    def test_selected_pairs(self):
+        m = self.pop.shape[1]
+        full = reference.measures(self.pop, self.locality)['expo_local']
+        for pairs, expected in (('isolation', [(0, 0), (1, 1), (2, 2)]),
+                                (1, [(1, 0), (1, 2)]),
+                                ([(0, 2), (2, 0), (0, 2)], [(0, 2), (2, 0)])):
+            selected = measures.exposure_pairs(m, pairs)
+            self.assertEqual(selected, expected)
+            columns = [i * m + j for i, j in selected]
+            for block_size in (None, 9):
+                result = measures.local_exposure(self.pop, self.locality, block_size,
+                                                 pairs=selected)
+                np.testing.assert_allclose(result, full[:, columns], rtol=1e-10, atol=1e-12)
+        with self.assertRaises(ValueError):
+            measures.exposure_pairs(m, [(0, m)])
+
+    def test_engine_pairs(self):
+        engine = SegregEngine(self.location, self.pop, exposure_pairs='isolation')
+        engine.cal_localityMatrix(BANDWIDTH, 1)
+        engine.compute(['expo_local'])
+        self.assertEqual(engine.local_exposure.shape, (len(self.pop), 3))
+        names = engine.resultColumns(['expo_local'])[0]
+        self.assertEqual(names[-3:], ['iso_00', 'iso_11', 'iso_22'])
+
+        # new pairs make the local exposure stale, not the global one
+        engine.compute(['expo_global'])
+        engine.setExposurePairs([(0, 1)])
+        self.assertEqual(engine.schedule(['expo_local', 'expo_global']), ['expo_local'])
+        engine.compute(['expo_local'])
+        full = reference.measures(self.pop, self.locality)['expo_local']
+        np.testing.assert_allclose(engine.local_exposure, full[:, [1]], rtol=1e-10, atol=1e-12)
+        self.assertEqual(engine.resultColumns(['expo_local'])[0][-1], 'exp_01')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Single precision intensity and local measures against double precision"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..engine import ALL_MEASURES, MEASURE_ATTRIBUTES, SegregEngine
+from ..intensity import locality_matrix
+from . import reference
+
+BANDWIDTH = 900
+
+
+class Float32Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.expected = reference.locality(cls.location, cls.pop, BANDWIDTH, 2)
+
+    def test_weight_sum_and_float32(self):
+        weight_sum = np.empty(len(self.pop))
+        result = locality_matrix(self.location, self.pop, BANDWIDTH, 2, 16, dtype=np.float32,
+                                 weight_sum=weight_sum)
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_allclose(result, self.expected, rtol=1e-6, atol=1e-4)
+        self.assertTrue(np.all(weight_sum >= 1.0))
+
+    def test_engine_float32(self):
+        expected = reference.measures(self.pop, self.expected)
+        engine = SegregEngine(self.location, self.pop, dtype=np.float32)
+        result = engine.run(ALL_MEASURES, BANDWIDTH, 2)
+        self.assertEqual(result.locality.dtype, np.float32)
+        for name in ALL_MEASURES:
+            value = np.asarray(getattr(result, MEASURE_ATTRIBUTES[name]))
+            # global sums stay in double precision
+            if name.endswith('_local'):
+                self.assertEqual(value.dtype, np.float32, name)
+            np.testing.assert_allclose(value.astype(float).reshape(np.shape(expected[name])),
+                                       expected[name], rtol=1e-4, atol=1e-5, err_msg=name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Fused local measures kernel against the single measure functions"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from .. import measures
+from . import reference
+
+BANDWIDTH = 900
+NAMES = dict(dissimilarity='diss_local', exposure='expo_local', entropy='entro_local',
+             indexh='idxh_local')
+
+
+class FusedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.locality = reference.locality(cls.location, cls.pop, BANDWIDTH, 1)
+
+    def test_fused_matches_reference(self):
+        for locality in (None, self.locality):
+            expected = reference.measures(self.pop, locality)
+            for block_size in (None, 1, 17):
+                fused = measures.fused_local_measures(self.pop, locality, block_size=block_size)
+                self.assertEqual(sorted(fused), sorted(NAMES))
+                for name, value in fused.items():
+                    np.testing.assert_allclose(value, expected[NAMES[name]], rtol=1e-10,
+                                               atol=1e-12, err_msg=name)
+
+    def test_selected_measures_and_out(self):
+        n = len(self.pop)
+        expected = measures.fused_local_measures(self.pop, self.locality)
+        out = dict(entropy=np.zeros((n, 1)))
+        fused = measures.fused_local_measures(self.pop, self.locality, ('entropy', 'indexh'), 9,
+                                              out=out, dtype=np.float32)
+        self.assertEqual(sorted(fused), ['entropy', 'indexh'])
+        self.assertIs(fused['entropy'], out['entropy'])
+        self.assertEqual(fused['indexh'].dtype, np.float32)
+        np.testing.assert_allclose(fused['entropy'], expected['entropy'], rtol=1e-12, atol=1e-14)
+        np.testing.assert_allclose(fused['indexh'], expected['indexh'], rtol=1e-5, atol=1e-6)
+
+    def test_unknown_measure(self):
+        with self.assertRaises(ValueError):
+            measures.fused_local_measures(self.pop, self.locality, ('dissimilarity', 'gini'))
+
+
+if __name__ == '__main__':
+    unittest.main()
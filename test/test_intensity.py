@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Blocked intensity engine against the original loop"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..intensity import locality_matrix
+from . import reference
+
+BANDWIDTH = 900
+KERNELS = (1, 2, 3)
+
+
+class LocalityMatrixTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.expected = dict((k, reference.locality(cls.location, cls.pop, BANDWIDTH, k))
+                            for k in KERNELS)
+
+    def test_blocked_matches_reference(self):
+        for weightmethod in KERNELS:
+            for block_size in (1, 7, 64, 1000):
+                result = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod,
+                                         block_size)
+                np.testing.assert_allclose(result, self.expected[weightmethod], rtol=1e-12,
+                                           atol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
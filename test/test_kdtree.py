@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""KD-tree neighbor path for compact kernels against the dense one"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from ..intensity import locality_matrix, neighbor_distances
+from . import reference
+
+BANDWIDTH = 900
+
+
+class KDTreeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+
+    def test_neighbor_distances(self):
+        distance = cdist(self.location, self.location)
+        for workers in (1, 3):
+            values, indices, indptr = neighbor_distances(self.location, BANDWIDTH, workers=workers)
+            self.assertEqual(indptr[-1], np.sum(distance <= BANDWIDTH))
+            rows = np.repeat(np.arange(len(self.location)), np.diff(indptr))
+            np.testing.assert_allclose(values, distance[rows, indices], rtol=1e-12, atol=1e-9)
+            self.assertTrue(np.all(distance[rows, indices] <= BANDWIDTH))
+
+    def test_kdtree_matches_reference(self):
+        for weightmethod in (2, 3):
+            expected = reference.locality(self.location, self.pop, BANDWIDTH, weightmethod)
+            for workers in (1, 3):
+                result = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod,
+                                         spatial_index=True, workers=workers)
+                np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Blocked measures against the original formulas"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..engine import ALL_MEASURES
+from .. import measures
+from . import reference
+
+BANDWIDTH = 900
+
+
+class MeasuresTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.locality = reference.locality(cls.location, cls.pop, BANDWIDTH, 1)
+
+    def assertMeasures(self, result, expected, names=ALL_MEASURES):
+        for name in names:
+            np.testing.assert_allclose(np.asarray(result[name], dtype=float).reshape(
+                np.shape(expected[name])), expected[name], rtol=1e-10, atol=1e-12, err_msg=name)
+
+    def single(self, locality, block_size=None):
+        """Measures of the single measure functions"""
+        local_diss = measures.local_dissimilarity(self.pop, locality, block_size)
+        local_exp = measures.local_exposure(self.pop, locality, block_size)
+        local_entro = measures.local_entropy(self.pop, locality, block_size)
+        global_entro = measures.global_entropy(self.pop)
+        local_h = measures.local_indexh(self.pop, local_entro, global_entro)
+        return dict(diss_local=local_diss,
+                    diss_global=measures.global_dissimilarity(local_diss),
+                    expo_local=local_exp,
+                    expo_global=measures.global_exposure(local_exp, self.pop.shape[1], block_size),
+                    entro_local=local_entro,
+                    entro_global=global_entro,
+                    idxh_local=local_h,
+                    idxh_global=measures.global_indexh(local_h))
+
+    def test_single_measures_match_reference(self):
+        for locality in (None, self.locality):
+            expected = reference.measures(self.pop, locality)
+            for block_size in (None, 1, 17):
+                self.assertMeasures(self.single(locality, block_size), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
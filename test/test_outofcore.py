@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Out-of-core intensity written to memmap files against in-memory runs"""
+from __future__ import absolute_import
+import shutil
+import tempfile
+import unittest
+from multiprocessing import shared_memory
+from unittest import mock
+import numpy as np
+
+from ..cache import ColumnCache
+from ..engine import ALL_MEASURES, MEASURE_ATTRIBUTES, SegregEngine
+from ..intensity import locality_matrix, process_backend_available
+from . import reference
+
+BANDWIDTH = 900
+KERNELS = (1, 2, 3)
+
+
+class OutOfCoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.expected = dict((k, reference.locality(cls.location, cls.pop, BANDWIDTH, k))
+                            for k in KERNELS)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='segreg_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def memmap(self, name, shape=None):
+        shape = self.pop.shape if shape is None else shape
+        return np.memmap('%s/%s.dat' % (self.path, name), dtype=float, mode='w+', shape=shape)
+
+    def test_kdtree_writes_out(self):
+        for weightmethod in (2, 3):
+            out = self.memmap('kdtree_%d' % weightmethod)
+            result = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod, 7,
+                                     spatial_index=True, out=out)
+            self.assertIs(result, out)
+            np.testing.assert_allclose(out, self.expected[weightmethod], rtol=1e-12, atol=1e-10)
+
+    @unittest.skipUnless(process_backend_available(), 'worker processes can not run here')
+    def test_processes_write_out_file(self):
+        created = []
+        original = shared_memory.SharedMemory
+
+        def tracked(*args, **kwargs):
+            if kwargs.get('create'):
+                created.append(kwargs['size'])
+            return original(*args, **kwargs)
+
+        for weightmethod in KERNELS:
+            del created[:]
+            out = self.memmap('process_%d' % weightmethod)
+            with mock.patch.object(shared_memory, 'SharedMemory', tracked):
+                result = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod, 16,
+                                         workers=2, backend='process', out=out)
+            self.assertIs(result, out)
+            # location, pop and the weight sums, no shared output block
+            self.assertEqual(len(created), 3)
+            np.testing.assert_allclose(out, self.expected[weightmethod], rtol=1e-12, atol=1e-10)
+
+    def test_engine_matches_reference(self):
+        expected = reference.measures(self.pop, self.expected[1])
+        for options in (dict(), dict(spatial_index=True), dict(reuse_weights=True),
+                        dict(workers=2, backend='process')):
+            for weightmethod in KERNELS:
+                engine = SegregEngine(self.location, self.pop, out_of_core=True,
+                                      memory_budget=4096, scratch_dir=self.path, **options)
+                try:
+                    result = engine.run(ALL_MEASURES, BANDWIDTH, weightmethod)
+                    self.assertIsInstance(result.locality, np.memmap)
+                    np.testing.assert_allclose(result.locality, self.expected[weightmethod],
+                                               rtol=1e-12, atol=1e-10)
+                    if weightmethod == 1:
+                        for name in ALL_MEASURES:
+                            np.testing.assert_allclose(
+                                np.asarray(getattr(result, MEASURE_ATTRIBUTES[name]),
+                                           dtype=float).reshape(np.shape(expected[name])),
+                                expected[name], rtol=1e-10, atol=1e-12, err_msg=name)
+                finally:
+                    engine.close()
+
+    def test_partial_column_hit_joins_into_out(self):
+        columns = ColumnCache()
+        pop = self.pop.copy()
+        pop[:, 1] *= 2
+        expected = reference.locality(self.location, pop, BANDWIDTH, 1)
+        for data, result in ((self.pop, self.expected[1]), (pop, expected)):
+            engine = SegregEngine(self.location, data, out_of_core=True, memory_budget=4096,
+                                  scratch_dir=self.path, column_cache=columns)
+            try:
+                locality = engine.cal_localityMatrix(BANDWIDTH, 1)
+                self.assertIsInstance(locality, np.memmap)
+                np.testing.assert_allclose(locality, result, rtol=1e-12, atol=1e-10)
+                # only the scratch file of the joined intensity is left
+                self.assertEqual(list(engine.scratch.arrays), ['locality'])
+            finally:
+                engine.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Thread and process workers of the intensity engine against the serial run"""
+from __future__ import absolute_import
+import multiprocessing
+import unittest
+from unittest import mock
+import numpy as np
+
+from ..intensity import locality_matrix, process_backend_available
+from . import reference
+
+BANDWIDTH = 900
+KERNELS = (1, 2, 3)
+
+
+class ParallelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.serial = dict((k, locality_matrix(cls.location, cls.pop, BANDWIDTH, k, 16))
+                          for k in KERNELS)
+
+    def test_threads_match_serial(self):
+        for weightmethod in KERNELS:
+            threads = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod, 16,
+                                      workers=3, backend='thread')
+            np.testing.assert_array_equal(threads, self.serial[weightmethod])
+
+    @unittest.skipUnless(process_backend_available(), 'worker processes can not run here')
+    def test_processes_match_serial(self):
+        for weightmethod in KERNELS:
+            processes = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod, 16,
+                                        workers=2, backend='process')
+            np.testing.assert_array_equal(processes, self.serial[weightmethod])
+
+    def test_spawned_processes_match_serial(self):
+        previous = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            self.assertTrue(process_backend_available())
+            processes = locality_matrix(self.location, self.pop, BANDWIDTH, 2, 16, workers=2,
+                                        backend='process')
+        finally:
+            multiprocessing.set_start_method(previous, force=True)
+        np.testing.assert_array_equal(processes, self.serial[2])
+
+    def test_embedded_interpreter_falls_back_to_threads(self):
+        for executable, expected in ((b'/usr/bin/qgis', False), ('/usr/bin/qgis', False),
+                                     (b'/usr/bin/python3', True)):
+            with mock.patch('multiprocessing.get_start_method', return_value='spawn'), \
+                    mock.patch('multiprocessing.spawn.get_executable', return_value=executable):
+                available = process_backend_available()
+                result = locality_matrix(self.location, self.pop, BANDWIDTH, 3, 16, workers=2,
+                                         backend='process')
+            self.assertEqual(available, expected)
+            np.testing.assert_array_equal(result, self.serial[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Measure scheduler and memo against fresh runs after the inputs change"""
+from __future__ import absolute_import
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from ..engine import ALL_MEASURES, MEASURE_ATTRIBUTES, SegregEngine
+from . import reference
+
+BANDWIDTHS = (900, 1500)
+
+
+class ScheduleTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.expected = dict((bw, reference.measures(cls.pop, reference.locality(
+            cls.location, cls.pop, bw, 1))) for bw in BANDWIDTHS)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='segreg_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def assertMeasures(self, engine, expected, names):
+        for name in names:
+            np.testing.assert_allclose(
+                np.asarray(getattr(engine, MEASURE_ATTRIBUTES[name]), dtype=float).reshape(
+                    np.shape(expected[name])), expected[name], rtol=1e-10, atol=1e-12,
+                err_msg=name)
+
+    def test_memo_skips_fresh_measures(self):
+        engine = SegregEngine(self.location, self.pop)
+        engine.cal_localityMatrix(BANDWIDTHS[0], 1)
+        self.assertEqual(engine.compute(['diss_local']), ['diss_local'])
+        self.assertEqual(engine.compute(['diss_local', 'diss_global']), ['diss_global'])
+        self.assertEqual(engine.schedule(['idxh_global']),
+                         ['entro_local', 'entro_global', 'idxh_local', 'idxh_global'])
+        self.assertEqual(engine.compute(['diss_local', 'diss_global']), [])
+
+    def test_new_bandwidth_recomputes_measures(self):
+        # with and without the result cache, which must not serve the old bandwidth
+        for cache_dir in (None, self.path):
+            engine = SegregEngine(self.location, self.pop, cache_dir=cache_dir)
+            selected = ['diss_local', 'diss_global', 'entro_global']
+            engine.cal_localityMatrix(BANDWIDTHS[0], 1)
+            engine.compute(['diss_local'])
+            self.assertMeasures(engine, self.expected[BANDWIDTHS[0]], ['diss_local'])
+
+            engine.cal_localityMatrix(BANDWIDTHS[1], 1)
+            self.assertFalse(engine.isFresh('diss_local'))
+            self.assertEqual(engine.schedule(selected), selected)
+            engine.compute(selected)
+            self.assertMeasures(engine, self.expected[BANDWIDTHS[1]], selected)
+
+            # the non spatial global entropy does not depend on the intensity
+            engine.cal_localityMatrix(BANDWIDTHS[0], 1)
+            self.assertEqual(engine.schedule(selected), ['diss_local', 'diss_global'])
+            engine.compute(selected)
+            self.assertMeasures(engine, self.expected[BANDWIDTHS[0]], selected)
+
+    def test_run_recomputes_all_measures(self):
+        engine = SegregEngine(self.location, self.pop)
+        for bandwidth in BANDWIDTHS + BANDWIDTHS[:1]:
+            result = engine.run(ALL_MEASURES, bandwidth, 1)
+            expected = self.expected[bandwidth]
+            self.assertMeasures(result, expected, ALL_MEASURES)
+            self.assertTrue(all(engine.isFresh(name) for name in ALL_MEASURES))
+
+
+if __name__ == '__main__':
+    unittest.main()
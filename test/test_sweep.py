@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Multi-bandwidth sweep against single bandwidth runs"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..engine import ALL_MEASURES, SegregEngine
+from ..sweep import bandwidth_sweep
+from . import reference
+
+BANDWIDTHS = [500, 900, 1500]
+KERNELS = [1, 2, 3]
+
+
+class SweepTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+
+    def check(self, spatial_index=False, tolerance=None):
+        rows, localities = bandwidth_sweep(self.location, self.pop, BANDWIDTHS, KERNELS, 16,
+                                           spatial_index, True, tolerance)
+        self.assertEqual([(r['weightmethod'], r['bandwidth']) for r in rows],
+                         [(k, bw) for k in KERNELS for bw in BANDWIDTHS])
+        m = self.pop.shape[1]
+        for row in rows:
+            combo = (row['weightmethod'], row['bandwidth'])
+            engine = SegregEngine(self.location, self.pop, spatial_index=spatial_index,
+                                  gauss_tolerance=tolerance)
+            result = engine.run(ALL_MEASURES, combo[1], combo[0])
+            np.testing.assert_allclose(localities[combo], result.locality, rtol=1e-12, atol=1e-10)
+            for name, expected in (('dissimil', result.global_dissimilarity),
+                                   ('entropy', result.global_entropy),
+                                   ('indexh', result.global_indexh)):
+                self.assertAlmostEqual(row[name], expected, places=12)
+            exposure = np.array([[row[('iso_' if i == j else 'exp_') + str(i) + str(j)]
+                                  for j in range(m)] for i in range(m)])
+            np.testing.assert_allclose(exposure, result.global_exposure, rtol=1e-12, atol=1e-14)
+
+    def test_dense_sweep(self):
+        self.check()
+
+    def test_kdtree_sweep(self):
+        self.check(spatial_index=True, tolerance=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
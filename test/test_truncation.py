@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Truncated gaussian intensity and its reported error against the exact kernel"""
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from ..engine import SegregEngine
+from ..intensity import locality_matrix, truncation_error
+from . import reference
+
+BANDWIDTH = 900
+TOLERANCES = (1e-2, 1e-4, 1e-6)
+
+
+class TruncationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        cls.exact = reference.locality(cls.location, cls.pop, BANDWIDTH, 1)
+
+    def test_truncated_gaussian_kdtree_matches_blocked(self):
+        dense = locality_matrix(self.location, self.pop, BANDWIDTH, 1, tolerance=1e-4)
+        sparse = locality_matrix(self.location, self.pop, BANDWIDTH, 1, spatial_index=True,
+                                 tolerance=1e-4)
+        np.testing.assert_allclose(sparse, dense, rtol=1e-12, atol=1e-10)
+
+    def test_error_bounds_truncation(self):
+        previous = np.inf
+        for tolerance in TOLERANCES:
+            truncated = locality_matrix(self.location, self.pop, BANDWIDTH, 1, tolerance=tolerance)
+            difference = np.max(np.fabs(truncated - self.exact))
+            # every tract is checked on layers smaller than the sample
+            for block_size in (1, 16, 1000):
+                error = truncation_error(self.location, self.pop, BANDWIDTH, tolerance, truncated,
+                                         block_size=block_size)
+                self.assertEqual(error['rows_checked'], len(self.pop))
+                self.assertGreaterEqual(error['max_abs_error'], difference * (1 - 1e-9))
+                self.assertAlmostEqual(error['max_abs_error'], difference, delta=difference * 1e-9)
+                self.assertAlmostEqual(error['max_rel_error'], difference / np.max(self.exact),
+                                       delta=1e-12)
+            # a sample never reports more than the whole layer
+            sampled = truncation_error(self.location, self.pop, BANDWIDTH, tolerance, truncated,
+                                       sample=20)
+            self.assertEqual(sampled['rows_checked'], 20)
+            self.assertLessEqual(sampled['max_abs_error'], difference * (1 + 1e-9))
+            self.assertLess(error['max_abs_error'], previous)
+            previous = error['max_abs_error']
+
+    def test_engine_reports_error(self):
+        for tolerance in TOLERANCES:
+            engine = SegregEngine(self.location, self.pop, gauss_tolerance=tolerance)
+            locality = engine.cal_localityMatrix(BANDWIDTH, 1)
+            difference = np.max(np.fabs(locality - self.exact))
+            self.assertAlmostEqual(engine.truncationError['max_abs_error'], difference,
+                                   delta=difference * 1e-9)
+            engine.cal_localityMatrix(BANDWIDTH, 2)
+            self.assertIsNone(engine.truncationError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Incremental population updates against a full recompute"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from .. import engine as engine_module
+from ..engine import ALL_MEASURES, MEASURE_ATTRIBUTES, SegregEngine
+from ..intensity import locality_matrix, locality_update
+from . import reference
+
+BANDWIDTH = 900
+ROWS = [0, 3, 40, 41]
+# (weightmethod, spatial_index, gauss_tolerance)
+OPTIONS = [(1, False, None), (2, False, None), (3, False, None), (2, True, None),
+           (3, True, None), (1, False, 1e-4), (1, True, 1e-4)]
+
+
+class UpdateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+        rng = np.random.RandomState(1)
+        cls.values = rng.poisson(150, (len(ROWS), cls.pop.shape[1])).astype(float)
+        cls.values[1] = 0
+        cls.values[2, 0] = -5
+        cls.updated = cls.pop.copy()
+        cls.updated[ROWS] = np.maximum(cls.values, 0)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='segreg_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_locality_update_matches_recompute(self):
+        delta = self.updated[ROWS] - self.pop[ROWS]
+        for weightmethod, spatial_index, tolerance in OPTIONS:
+            weight_sum = np.empty(len(self.pop))
+            locality = locality_matrix(self.location, self.pop, BANDWIDTH, weightmethod,
+                                       spatial_index=spatial_index, tolerance=tolerance,
+                                       weight_sum=weight_sum)
+            locality_update(self.location, locality, weight_sum, ROWS, delta, BANDWIDTH,
+                            weightmethod, tolerance)
+            expected = locality_matrix(self.location, self.updated, BANDWIDTH, weightmethod,
+                                       spatial_index=spatial_index, tolerance=tolerance)
+            np.testing.assert_allclose(locality, expected, rtol=1e-10, atol=1e-10,
+                                       err_msg=str(weightmethod))
+
+    def test_engine_update_matches_recompute(self):
+        for weightmethod, spatial_index, tolerance in OPTIONS:
+            options = dict(spatial_index=spatial_index, gauss_tolerance=tolerance)
+            engine = SegregEngine(self.location, self.pop, **options)
+            engine.run(ALL_MEASURES, BANDWIDTH, weightmethod)
+            computed = engine.updatePopulation(ROWS, self.values)
+            self.assertEqual(sorted(computed), sorted(ALL_MEASURES))
+
+            fresh = SegregEngine(self.location, self.updated, **options)
+            fresh.run(ALL_MEASURES, BANDWIDTH, weightmethod)
+            np.testing.assert_array_equal(engine.pop, self.updated)
+            np.testing.assert_allclose(engine.locality, fresh.locality, rtol=1e-10, atol=1e-10)
+            for name in ALL_MEASURES:
+                np.testing.assert_allclose(getattr(engine, MEASURE_ATTRIBUTES[name]),
+                                           getattr(fresh, MEASURE_ATTRIBUTES[name]),
+                                           rtol=1e-8, atol=1e-10, err_msg=name)
+
+    def test_update_keeps_selection(self):
+        engine = SegregEngine(self.location, self.pop)
+        engine.cal_localityMatrix(BANDWIDTH, 2)
+        engine.compute(['diss_global'])
+        self.assertEqual(engine.updatePopulation(ROWS, self.values),
+                         ['diss_local', 'diss_global'])
+        self.assertIsNone(engine.local_entropy)
+
+    def test_update_skips_result_cache(self):
+        engine = SegregEngine(self.location, self.pop, cache_dir=self.path)
+        engine.run(ALL_MEASURES, BANDWIDTH, 2)
+        files = sorted(os.listdir(self.path))
+        failure = AssertionError('result cache used by a live update')
+        with mock.patch.object(engine_module, 'cache_key', side_effect=failure), \
+                mock.patch.object(engine.cache, 'get', side_effect=failure), \
+                mock.patch.object(engine.cache, 'put', side_effect=failure):
+            engine.updatePopulation(ROWS, self.values)
+        self.assertIsNotNone(engine.cache)
+        self.assertEqual(sorted(os.listdir(self.path)), files)
+
+
+if __name__ == '__main__':
+    unittest.main()
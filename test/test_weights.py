@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""WeightMatrix round trip through the .npz sidecar and reuse checks"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from ..engine import SegregEngine
+from ..weights import WeightMatrix
+from . import reference
+
+BANDWIDTH = 900
+
+# (weightmethod, tolerance, stored as csr)
+FORMS = [(1, None, False), (2, None, True), (1, 1e-4, True)]
+
+
+class WeightMatrixTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location, cls.pop = reference.random_layer()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='segreg_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_save_load_round_trip(self):
+        for weightmethod, tolerance, sparse in FORMS:
+            weights = WeightMatrix.build(self.location, BANDWIDTH, weightmethod, 16,
+                                         tolerance=tolerance)
+            self.assertEqual(weights.is_sparse, sparse)
+            path = WeightMatrix.sidecar_path(os.path.join(self.folder, 'layer.shp'), BANDWIDTH,
+                                             weightmethod, tolerance)
+            weights.save(path)
+            loaded = WeightMatrix.load(path)
+            self.assertEqual(loaded.is_sparse, sparse)
+            self.assertEqual((loaded.bandwidth, loaded.weightmethod, loaded.tolerance),
+                             (BANDWIDTH, weightmethod, tolerance))
+            self.assertTrue(loaded.matches(self.location, BANDWIDTH, weightmethod, tolerance))
+
+            engine = SegregEngine(self.location, self.pop, gauss_tolerance=tolerance)
+            expected = engine.cal_localityMatrix(BANDWIDTH, weightmethod)
+            np.testing.assert_allclose(loaded.apply(self.pop), expected, rtol=1e-12, atol=1e-10)
+
+    def test_matches_rejects_changes(self):
+        for weightmethod, tolerance, sparse in FORMS:
+            weights = WeightMatrix.build(self.location, BANDWIDTH, weightmethod,
+                                         tolerance=tolerance)
+            moved = self.location.copy()
+            moved[3, 0] += 1.0
+            self.assertFalse(weights.matches(moved, BANDWIDTH, weightmethod, tolerance))
+            self.assertFalse(weights.matches(self.location, BANDWIDTH + 1, weightmethod, tolerance))
+            self.assertFalse(weights.matches(self.location, BANDWIDTH, 3, tolerance))
+            other = 1e-2 if tolerance is None else None
+            if weightmethod == 1:
+                self.assertFalse(weights.matches(self.location, BANDWIDTH, weightmethod, other))
+
+    def test_engine_reuses_sidecar(self):
+        source = os.path.join(self.folder, 'layer.shp')
+        engine = SegregEngine(self.location, self.pop, reuse_weights=True, weight_sidecar=source)
+        expected = np.array(engine.cal_localityMatrix(BANDWIDTH, 2))
+        path = WeightMatrix.sidecar_path(source, BANDWIDTH, 2)
+        self.assertTrue(os.path.exists(path))
+
+        engine = SegregEngine(self.location, self.pop, reuse_weights=True, weight_sidecar=source)
+        np.testing.assert_array_equal(engine.cal_localityMatrix(BANDWIDTH, 2), expected)
+        self.assertTrue(engine.weightMatrix.matches(self.location, BANDWIDTH, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
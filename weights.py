@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ Segreg
+                                 A QGIS plugin
+ This plugin computes spatial and non spatial segregation measures
+                              -------------------
+        begin                : 2017-01-25
+        copyright            : (C) 2017 by Sandro Sousa / USP-UFABC
+        email                : sandrofsousa@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Reusable spatial weight matrix with on-disk persistence.
+"""
+from __future__ import absolute_import
+from builtins import object
+from builtins import range
+import hashlib
+import os.path
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from scipy.spatial.distance import cdist
+
+from .intensity import DEFAULT_BLOCK_SIZE, kernel_weights, neighbor_weights, support_radius
+
+
+def geometry_fingerprint(location):
+    """
+    Hash the tract coordinates to identify the geometry a matrix was built on.
+    :param location: 2d array like with x and y coordinates of each tract
+    :return: hex digest string
+    """
+    location = np.ascontiguousarray(location, dtype=float)
+    digest = hashlib.sha1(location.tobytes())
+    digest.update(str(location.shape).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class WeightMatrix(object):
+    """
+    Kernel weights between all tracts for one (geometry, bandwidth, kernel).
+    Compact kernels (bi-square, moving window and the truncated gaussian)
+    are stored as CSR, the exact gaussian kernel as a dense array.
+    """
+
+    def __init__(self, weights, bandwidth, weightmethod, fingerprint, tolerance=None):
+        """
+        :param weights: n x n scipy csr_matrix or 2d numpy array
+        :param bandwidth: bandwidth for neighborhood in meters
+        :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+        :param fingerprint: geometry hash from geometry_fingerprint()
+        :param tolerance: relative tolerance of a truncated gaussian, None if exact
+        """
+        self.weights = weights
+        self.bandwidth = bandwidth
+        self.weightmethod = weightmethod
+        self.fingerprint = fingerprint
+        self.tolerance = tolerance
+        self.row_sum = np.asarray(weights.sum(axis=1)).ravel()
+
+    @classmethod
+    def build(cls, location, bandwidth, weightmethod, block_size=DEFAULT_BLOCK_SIZE, out=None,
+              tolerance=None):
+        """
+        Compute the weights for all tracts.
+        :param location: 2d array like with x and y coordinates of each tract
+        :param bandwidth: bandwidth for neighborhood in meters
+        :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+        :param block_size: tracts computed at once for the dense version
+        :param out: optional n x n array (or memmap) to store the dense version
+        :param tolerance: relative tolerance to truncate the gaussian, None for the exact kernel
+        :return: WeightMatrix instance
+        """
+        location = np.asarray(location, dtype=float)
+        fingerprint = geometry_fingerprint(location)
+        if weightmethod != 1:
+            tolerance = None
+
+        if support_radius(bandwidth, weightmethod, tolerance) is not None:
+            weights = neighbor_weights(location, bandwidth, weightmethod, tolerance=tolerance)
+        else:
+            n_local = location.shape[0]
+            block_size = max(1, int(block_size))
+            weights = np.empty((n_local, n_local)) if out is None else out
+            for start in range(0, n_local, block_size):
+                stop = min(start + block_size, n_local)
+                block = weights[start:stop]
+                block[...] = cdist(location[start:stop], location)
+                kernel_weights(block, bandwidth, weightmethod, out=block)
+
+        return cls(weights, bandwidth, weightmethod, fingerprint, tolerance)
+
+    @property
+    def is_sparse(self):
+        return issparse(self.weights)
+
+    @property
+    def shape(self):
+        return self.weights.shape
+
+    @property
+    def nbytes(self):
+        """Memory used by the weights"""
+        if self.is_sparse:
+            return self.weights.data.nbytes + self.weights.indices.nbytes + self.weights.indptr.nbytes
+        return self.weights.nbytes
+
+    def matches(self, location, bandwidth, weightmethod, tolerance=None):
+        """Check if the matrix was built for this geometry, bandwidth, kernel and tolerance"""
+        if weightmethod != 1:
+            tolerance = None
+        return (self.bandwidth == bandwidth and self.weightmethod == weightmethod and
+                self.tolerance == tolerance and self.fingerprint == geometry_fingerprint(location))
+
+    def apply(self, pop, out=None, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Compute the population intensity for all groups with a single product,
+        or by row blocks when writing to out.
+        :param pop: 2d array like with population of each group by tract
+        :param out: optional n x m array (or memmap) to write the result to
+        :param block_size: rows written to out at once
+        :return: 2d array with population intensity for all groups
+        """
+        pop = np.asarray(pop, dtype=float)
+        if out is None:
+            locality = np.asarray(self.weights.dot(pop))
+            locality /= self.row_sum[:, None]
+
+            # assign zero to negative values
+            locality[locality < 0] = 0
+            return locality
+
+        n_local = self.shape[0]
+        block_size = max(1, int(block_size))
+        for start in range(0, n_local, block_size):
+            stop = min(start + block_size, n_local)
+            block = np.asarray(self.weights[start:stop].dot(pop))
+            block /= self.row_sum[start:stop, None]
+            block[block < 0] = 0
+            out[start:stop] = block
+        return out
+
+    @staticmethod
+    def sidecar_path(base, bandwidth, weightmethod, tolerance=None):
+        """
+        Name of the .npz sidecar for a source file.
+        :param base: path of the source layer file
+        :param bandwidth: bandwidth for neighborhood in meters
+        :param weightmethod: 1 for gaussian, 2 for bi-square and 3 for moving window
+        :param tolerance: relative tolerance of a truncated gaussian
+        :return: path string
+        """
+        if weightmethod == 1 and tolerance is not None:
+            return "%s_weights_%s_%s_tol%s.npz" % (os.path.splitext(base)[0], weightmethod,
+                                                   bandwidth, tolerance)
+        return "%s_weights_%s_%s.npz" % (os.path.splitext(base)[0], weightmethod, bandwidth)
+
+    def save(self, path):
+        """Save the matrix to a .npz file"""
+        meta = dict(bandwidth=self.bandwidth, weightmethod=self.weightmethod,
+                    fingerprint=self.fingerprint,
+                    tolerance=np.nan if self.tolerance is None else self.tolerance)
+        with open(path, 'wb') as f:
+            if self.is_sparse:
+                weights = self.weights.tocsr()
+                np.savez(f, data=weights.data, indices=weights.indices, indptr=weights.indptr,
+                         shape=weights.shape, **meta)
+            else:
+                np.savez(f, weights=self.weights, **meta)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a matrix saved with save().
+        :param path: path of the .npz file
+        :return: WeightMatrix instance
+        """
+        with np.load(path) as f:
+            if 'weights' in f.files:
+                weights = f['weights']
+            else:
+                weights = csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            bandwidth = f['bandwidth'].item()
+            weightmethod = int(f['weightmethod'])
+            fingerprint = str(f['fingerprint'])
+            tolerance = f['tolerance'].item() if 'tolerance' in f.files else np.nan
+
+        if np.isnan(tolerance):
+            tolerance = None
+        return cls(weights, bandwidth, weightmethod, fingerprint, tolerance)